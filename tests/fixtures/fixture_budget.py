@@ -0,0 +1,28 @@
+from urllib.parse import urlsplit
+
+import pytest
+from django.core.cache import cache
+from django.urls import resolve
+
+from core.budgets import QueryRecorder, get_budget, violation
+
+
+@pytest.fixture
+def query_budget(db):
+    """Запрос клиентом с проверкой бюджета запросов представления.
+
+    Кэш очищается перед запросом: бюджет рассчитан на холодный кэш.
+    """
+    def request(client, method, url, *args, **kwargs):
+        match = resolve(urlsplit(url).path)
+        budget = get_budget(match.func)
+        assert budget is not None, (
+            f'У представления `{match.view_name}` не задан бюджет запросов'
+        )
+        cache.clear()
+        with QueryRecorder() as recorder:
+            response = getattr(client, method)(url, *args, **kwargs)
+        message = violation(match.view_name, budget, recorder)
+        assert message is None, message
+        return response
+    return request
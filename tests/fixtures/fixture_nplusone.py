@@ -0,0 +1,25 @@
+import pytest
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers',
+        'nplusone_allow(*patterns): формы запросов, которые тесту можно '
+        'повторять сверх NPLUSONE_ALLOWLIST',
+    )
+
+
+@pytest.fixture(autouse=True)
+def nplusone(settings, request):
+    """Роняет запрос клиентом, если ответ сделал N+1 или повторы.
+
+    Новые формы запросов, повторяющиеся за один ответ, приводят к
+    NPlusOneError; известные перечислены в NPLUSONE_ALLOWLIST, а
+    отдельному тесту их можно добавить меткой nplusone_allow.
+    """
+    settings.NPLUSONE_CHECK = True
+    settings.NPLUSONE_RAISE = True
+    marker = request.node.get_closest_marker('nplusone_allow')
+    if marker is not None:
+        settings.NPLUSONE_ALLOWLIST = [*settings.NPLUSONE_ALLOWLIST,
+                                       *marker.args]
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def no_profiling(settings):
+    """Выключает выборочное профилирование, как core.runner для
+    manage.py test: случайная выборка делала бы ответы разными."""
+    settings.PROFILING_SAMPLE_RATE = 0
@@ -0,0 +1,107 @@
+import re
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+
+from core.budgets import QueryRecorder
+from core.nplusone import NPlusOneError, find_repeats
+
+try:
+    from posts.models import Comment
+except ImportError:
+    assert False, 'Не найдена модель Comment'
+
+
+def comment_many(post, count):
+    User = get_user_model()
+    for number in range(count):
+        author = User.objects.create_user(username=f'reader{number}')
+        Comment.objects.create(post=post, author=author, text='Ответ')
+
+
+class TestNPlusOne:
+
+    @pytest.mark.django_db
+    def test_comment_authors_detected(self, post):
+        comment_many(post, 3)
+        with QueryRecorder(stacks=True) as recorder:
+            names = [comment.author.username
+                     for comment in post.comments.all()]
+        assert len(names) == 3
+        repeats = find_repeats(recorder.queries)
+        assert len(repeats) == 1 and repeats[0].kind == 'N+1', (
+            'Загрузка автора каждого комментария отдельным запросом '
+            'должна распознаваться как N+1'
+        )
+        assert '"auth_user"' in repeats[0].shape
+
+    @pytest.mark.django_db
+    def test_duplicates_detected(self, post):
+        with QueryRecorder(stacks=True) as recorder:
+            for _ in range(2):
+                list(Comment.objects.filter(post=post))
+        repeats = find_repeats(recorder.queries)
+        assert len(repeats) == 1 and repeats[0].kind == 'дубликаты', (
+            'Повтор запроса с теми же параметрами должен распознаваться '
+            'как дубликат'
+        )
+
+    @pytest.mark.django_db
+    def test_in_lists_share_shape(self, post):
+        with QueryRecorder(stacks=True) as recorder:
+            for count in (1, 2, 3):
+                list(Comment.objects.filter(pk__in=range(count)))
+        assert len(find_repeats(recorder.queries)) == 1, (
+            'Списки IN разной длины должны давать одну форму запроса'
+        )
+
+    @pytest.mark.django_db
+    def test_post_detail_without_nplusone(self, client, post):
+        post.image = ''
+        post.save()
+        comment_many(post, 5)
+        response = client.get(f'/posts/{post.pk}/')
+        assert response.status_code == 200, (
+            'Страница поста с комментариями разных авторов должна '
+            'открываться без N+1'
+        )
+
+    @pytest.mark.django_db
+    def test_middleware_raises(self, client, post, settings):
+        settings.NPLUSONE_THRESHOLD = 1
+        with pytest.raises(NPlusOneError):
+            client.get(f'/posts/{post.pk}/')
+
+    @pytest.mark.nplusone_allow('*')
+    @pytest.mark.django_db
+    def test_marker_allows(self, client, post, settings):
+        settings.NPLUSONE_THRESHOLD = 1
+        response = client.get(f'/posts/{post.pk}/')
+        assert response.status_code == 200
+
+    @pytest.mark.django_db
+    def test_missing_prefetch_reported_with_stacks(self, client, post,
+                                                   monkeypatch):
+        post.image = ''
+        post.save()
+        comment_many(post, 5)
+        monkeypatch.setattr(QuerySet, 'prefetch_related',
+                            lambda self, *lookups: self)
+        with pytest.raises(NPlusOneError) as error:
+            client.get(f'/posts/{post.pk}/')
+        lines = str(error.value).splitlines()
+        assert (lines[1].startswith('N+1: 5 раз')
+                and '"auth_user"' in lines[2]), (
+            'Загрузка авторов комментариев без prefetch_related должна '
+            'распознаваться как N+1'
+        )
+        stack = [line.strip() for line in lines[3:]]
+        assert any(re.fullmatch(r'posts/views\.py:\d+ in post_detail', place)
+                   for place in stack), (
+            'В отчёте должен быть вызов из представления post_detail'
+        )
+        assert stack[-1] == 'posts/includes/comments.html:21', (
+            'Отчёт должен указывать строку шаблона комментариев, где '
+            'читается автор'
+        )
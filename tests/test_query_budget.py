@@ -0,0 +1,80 @@
+import pytest
+from django.urls import get_resolver
+
+from core.budgets import get_budget
+
+try:
+    from posts.models import Comment, Follow, Post
+except ImportError:
+    assert False, 'Не найдены модели Comment, Follow и Post'
+
+
+def without_images():
+    # Картинки фикстур — несуществующие файлы, и sorl нарезал бы их
+    # миниатюры прямо при рендере. На сайте их заранее нарезает
+    # thumbnails.schedule, так что в бюджет это не входит.
+    Post.objects.update(image='')
+
+
+class TestQueryBudget:
+
+    @pytest.fixture(autouse=True)
+    def media_root(self, settings, tmp_path):
+        # Картинки фикстур и файлы .part загрузок по частям не должны
+        # оставаться в настоящем MEDIA_ROOT.
+        settings.MEDIA_ROOT = str(tmp_path)
+
+    def test_every_posts_view_has_budget(self):
+        resolver = get_resolver()
+        for pattern in resolver.url_patterns:
+            if getattr(pattern, 'namespace', None) != 'posts':
+                continue
+            for view in pattern.url_patterns:
+                assert get_budget(view.callback) is not None, (
+                    f'У представления `posts:{view.name}` не задан бюджет '
+                    f'запросов. Добавьте декоратор `@query_budget`'
+                )
+
+    @pytest.mark.django_db
+    def test_guest_pages(self, client, query_budget, few_posts_with_group):
+        post = few_posts_with_group
+        Comment.objects.create(post=post, author=post.author, text='Ответ')
+        without_images()
+        for url in ('/', f'/group/{post.group.slug}/',
+                    f'/profile/{post.author.username}/',
+                    f'/posts/{post.pk}/', '/search/?q=пост'):
+            response = query_budget(client, 'get', url)
+            assert response.status_code == 200, url
+
+    @pytest.mark.django_db
+    def test_user_pages(self, user_client, query_budget, another_user,
+                        another_few_posts_with_group_with_follower):
+        post = another_user.posts.first()
+        without_images()
+        for url in ('/', '/follow/', f'/profile/{another_user.username}/',
+                    f'/posts/{post.pk}/', '/create/'):
+            response = query_budget(user_client, 'get', url)
+            assert response.status_code == 200, url
+
+    @pytest.mark.django_db
+    def test_user_actions(self, user, user_client, query_budget, another_user,
+                          post_with_group):
+        without_images()
+        query_budget(user_client, 'post', '/create/',
+                     data={'text': 'Новый пост'})
+        query_budget(user_client, 'get', f'/posts/{post_with_group.pk}/edit/')
+        query_budget(user_client, 'post',
+                     f'/posts/{post_with_group.pk}/edit/',
+                     data={'text': 'Исправленный пост'})
+        query_budget(user_client, 'post',
+                     f'/posts/{post_with_group.pk}/comment/',
+                     data={'text': 'Комментарий'})
+        query_budget(user_client, 'get',
+                     f'/profile/{another_user.username}/follow/')
+        assert Follow.objects.filter(user=user, author=another_user).exists()
+        query_budget(user_client, 'get',
+                     f'/profile/{another_user.username}/unfollow/')
+        response = query_budget(user_client, 'post', '/uploads/',
+                                data={'filename': 'a.gif', 'size': 10})
+        query_budget(user_client, 'get',
+                     f'/uploads/{response.json()["id"]}/')
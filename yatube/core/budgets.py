@@ -0,0 +1,132 @@
+"""Бюджеты запросов к базе для представлений.
+
+Представление объявляет, сколько запросов ему можно сделать за один
+ответ, декоратором @query_budget(n) — вместе с сессией, пользователем
+и всеми шаблонами при холодном кэше. Бюджет проверяют тесты
+(фикстура query_budget в tests/), а при QUERY_BUDGET_CHECK ещё и
+QueryBudgetMiddleware на каждом запросе: превышение пишется в лог со
+всеми запросами и местами в шаблонах, откуда они пришли.
+"""
+import os
+import re
+import sys
+from collections import namedtuple
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+# Управление транзакциями: в тестах это SAVEPOINT, в работе BEGIN, так
+# что в бюджет оно не входит.
+TRANSACTION_SQL = re.compile(r'^\s*(BEGIN|SAVEPOINT|RELEASE|ROLLBACK)\b',
+                             re.IGNORECASE)
+# Код проекта для стеков вызовов — всё, что лежит под BASE_DIR.
+PROJECT_DIR = os.path.join(settings.BASE_DIR, '')
+# Промежуточные слои и обёртки, которые сами запросов не делают.
+INSTRUMENTATION = {os.path.join(os.path.dirname(__file__), name)
+                   for name in ('budgets.py', 'middleware.py',
+                                'profiling.py')}
+
+Query = namedtuple('Query', 'sql params origin stack')
+
+
+def query_budget(limit):
+    """Задаёт представлению наибольшее число запросов за ответ."""
+    def decorator(view):
+        # functools.wraps в декораторах выше копирует атрибут наружу.
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def get_budget(view):
+    return getattr(view, 'query_budget', None)
+
+
+def template_stack():
+    """Места в шаблонах, рендер которых сейчас идёт, от внешнего к
+    внутреннему."""
+    stack = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code is Node.render_annotated.__code__:
+            node = frame.f_locals['self']
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                name = origin.template_name or origin.name
+                place = f'{name}:{token.lineno}'
+                if not stack or stack[-1] != place:
+                    stack.append(place)
+        frame = frame.f_back
+    return stack[::-1]
+
+
+def template_origin():
+    """Шаблон и строка, рендер которой сейчас выполняется, если есть."""
+    stack = template_stack()
+    return stack[-1] if stack else None
+
+
+def python_stack():
+    """Вызовы в коде проекта (не в библиотеках), от внешнего к
+    внутреннему."""
+    stack = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if path.startswith(PROJECT_DIR) and path not in INSTRUMENTATION:
+            stack.append(f'{os.path.relpath(path, settings.BASE_DIR)}:'
+                         f'{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return stack[::-1]
+
+
+class QueryRecorder:
+    """Записывает SQL всех соединений и места в шаблонах, откуда он.
+
+    С stacks=True для каждого запроса сохраняются ещё и стеки вызовов в
+    коде проекта и в шаблонах — это дороже, нужно для поиска N+1.
+    """
+
+    def __init__(self, stacks=False):
+        self.queries = []
+        self.stacks = stacks
+        self.stack = ExitStack()
+
+    def __enter__(self):
+        for alias in connections:
+            self.stack.enter_context(
+                connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not TRANSACTION_SQL.match(sql):
+            if self.stacks:
+                templates = template_stack()
+                self.queries.append(Query(
+                    sql, params, templates[-1] if templates else None,
+                    python_stack() + templates))
+            else:
+                self.queries.append(Query(sql, params, template_origin(),
+                                          None))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def report(self):
+        return '\n'.join(f'  [{query.origin or "-"}] {query.sql}'
+                         for query in self.queries)
+
+
+def violation(view_name, budget, recorder):
+    """Текст о превышении бюджета или None, если бюджет соблюдён."""
+    if budget is None or len(recorder) <= budget:
+        return None
+    return (f'{view_name}: {len(recorder)} запросов к базе при бюджете '
+            f'{budget}\n{recorder.report()}')
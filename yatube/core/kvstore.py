@@ -0,0 +1,107 @@
+"""Хранилище метаданных sorl-thumbnail для THUMBNAIL_KVSTORE.
+
+Поверх штатного cached_db хранилища держит ограниченный LRU в памяти
+процесса: повторные обращения к одной миниатюре не ходят ни в общий
+кэш, ни в базу. Записи LRU живут не дольше
+THUMBNAIL_KVSTORE_LRU_TIMEOUT, так что изменения из других процессов
+видны с этой задержкой.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE, KVStore as CachedDBKVStore)
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+
+class LRUCache:
+    """Потокобезопасный LRU со сроком жизни записей."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.timeout)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class KVStore(CachedDBKVStore):
+    def __init__(self):
+        super().__init__()
+        self.lru = LRUCache(settings.THUMBNAIL_KVSTORE_LRU_SIZE,
+                            settings.THUMBNAIL_KVSTORE_LRU_TIMEOUT)
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        self.lru.clear()
+
+    def prefetch(self, keys, identity='image'):
+        """Загружает пачку ключей разом: get_many по кэшу и один запрос.
+
+        Промахи базы тоже попадают в кэш, чтобы следующий поштучный
+        поиск не шёл в базу.
+        """
+        raw_keys = [add_prefix(key, identity) for key in keys]
+        missing = [key for key in raw_keys if self.lru.get(key) is None]
+        if not missing:
+            return
+        found = self.cache.get_many(missing)
+        absent = [key for key in missing if key not in found]
+        if absent:
+            stored = dict(KVStoreModel.objects
+                          .filter(key__in=absent)
+                          .values_list('key', 'value'))
+            loaded = {key: stored.get(key, EMPTY_VALUE) for key in absent}
+            self.cache.set_many(loaded,
+                                thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+            found.update(loaded)
+        for key, value in found.items():
+            if value != EMPTY_VALUE:
+                self.lru.set(key, value)
+
+    def _get_raw(self, key):
+        value = self.lru.get(key)
+        if value is None:
+            value = super()._get_raw(key)
+            if value is not None:
+                self.lru.set(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self.lru.set(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        self.lru.delete(*keys)
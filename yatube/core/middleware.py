@@ -0,0 +1,105 @@
+import logging
+import random
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .budgets import QueryRecorder, get_budget, violation
+from .nplusone import NPlusOneError, find_repeats, report
+from .profiling import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+
+def check_enabled(value):
+    """Значение настройки проверки: None означает «пока DEBUG»."""
+    return settings.DEBUG if value is None else value
+
+
+class QueryBudgetMiddleware:
+    """Пишет в лог ответы, превысившие бюджет запросов представления.
+
+    Включается настройкой QUERY_BUDGET_CHECK; по умолчанию проверяются
+    запросы, пришедшие при DEBUG.
+    """
+
+    def __init__(self, get_response):
+        if settings.QUERY_BUDGET_CHECK is False:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not check_enabled(settings.QUERY_BUDGET_CHECK):
+            return self.get_response(request)
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        match = request.resolver_match
+        if match is not None:
+            message = violation(match.view_name,
+                                get_budget(match.func), recorder)
+            if message:
+                logger.warning(message)
+        return response
+
+
+class NPlusOneMiddleware:
+    """Ищет в ответах N+1 и повторяющиеся запросы (core.nplusone).
+
+    Включается настройкой NPLUSONE_CHECK (по умолчанию при DEBUG) и
+    пишет находки в лог, а при NPLUSONE_RAISE бросает NPlusOneError.
+    """
+
+    def __init__(self, get_response):
+        if settings.NPLUSONE_CHECK is False:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not check_enabled(settings.NPLUSONE_CHECK):
+            return self.get_response(request)
+        with QueryRecorder(stacks=True) as recorder:
+            response = self.get_response(request)
+        match = request.resolver_match
+        message = report(match.view_name if match else request.path,
+                         find_repeats(recorder.queries))
+        if message:
+            if settings.NPLUSONE_RAISE:
+                raise NPlusOneError(message)
+            logger.warning(message)
+        return response
+
+
+class ProfilingMiddleware:
+    """Профилирует долю запросов: Server-Timing и строка в логе.
+
+    Доля задаётся PROFILING_SAMPLE_RATE, при 0 профилирование
+    выключено, а при DEBUG профилируется каждый запрос. Обе настройки
+    проверяются на каждом запросе: тестовый прогон выключает DEBUG и
+    ставит долю 0, и тесты не засыпают вывод профилями. Замеры
+    отдаются только для представлений из PROFILING_NAMESPACES.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate():
+            return self.get_response(request)
+        with RequestProfile() as profile:
+            response = self.get_response(request)
+        match = request.resolver_match
+        if match is None or not set(match.namespaces) & set(
+                settings.PROFILING_NAMESPACES):
+            return response
+        response['Server-Timing'] = profile.server_timing()
+        profile.log(request, response)
+        return response
+
+    @staticmethod
+    def sample_rate():
+        rate = settings.PROFILING_SAMPLE_RATE
+        if rate and settings.DEBUG:
+            return 1
+        return rate
@@ -20,7 +20,7 @@ class PubDateModel(models.Model):
                             help_text='Введите текст')
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-pk')
         abstract = True
 
     def __str__(self):
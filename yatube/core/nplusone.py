@@ -0,0 +1,88 @@
+"""Поиск N+1 и повторяющихся запросов к базе за один ответ.
+
+Запросы ответа, записанные QueryRecorder(stacks=True), группируются по
+форме — тексту SQL без параметров, где список IN (...) любой длины
+считается одним и тем же. Подозрительными считаются:
+
+* N+1 — одна форма NPLUSONE_THRESHOLD и больше раз с разными
+  параметрами, обычно обращение к связанному объекту в цикле;
+* дубликаты — один и тот же запрос с теми же параметрами дважды и
+  больше.
+
+Для каждой находки сообщаются стеки вызовов в коде проекта и в
+шаблонах, откуда пришёл второй такой запрос: первый обычно законный.
+Известные и принятые формы перечисляются шаблонами fnmatch в
+NPLUSONE_ALLOWLIST. Проверяют NPlusOneMiddleware (при NPLUSONE_CHECK
+пишет в лог или, при NPLUSONE_RAISE, бросает NPlusOneError) и плагин
+tests/ для pytest.
+"""
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+
+from django.conf import settings
+
+IN_LIST = re.compile(r'\bIN \((?:%s, )*%s\)')
+
+
+class NPlusOneError(Exception):
+    """Ответ сделал N+1 или повторяющиеся запросы."""
+
+
+@dataclass
+class Repeat:
+    """Форма запроса, выполненная за ответ несколько раз."""
+
+    shape: str
+    count: int
+    duplicates: int
+    stack: list
+
+    @property
+    def kind(self):
+        return 'дубликаты' if self.duplicates == self.count else 'N+1'
+
+    def describe(self):
+        lines = [f'{self.kind}: {self.count} раз '
+                 f'(повторов с теми же параметрами: {self.duplicates})',
+                 f'  {self.shape}']
+        lines.extend(f'    {place}' for place in self.stack)
+        return '\n'.join(lines)
+
+
+def normalize(sql):
+    """Форма запроса: SQL без параметров и без длины списков IN."""
+    return ' '.join(IN_LIST.sub('IN (...)', sql).split())
+
+
+def allowed(shape):
+    return any(fnmatchcase(shape, pattern)
+               for pattern in settings.NPLUSONE_ALLOWLIST)
+
+
+def find_repeats(queries):
+    """Подозрительные повторы среди записанных запросов."""
+    groups = defaultdict(list)
+    for query in queries:
+        groups[normalize(query.sql)].append(query)
+    repeats = []
+    for shape, group in groups.items():
+        calls = Counter((query.sql, repr(query.params)) for query in group)
+        duplicates = sum(count for count in calls.values() if count > 1)
+        if len(group) < settings.NPLUSONE_THRESHOLD and not duplicates:
+            continue
+        if allowed(shape):
+            continue
+        extra = group[min(1, len(group) - 1)]
+        repeats.append(Repeat(shape, len(group), duplicates,
+                              extra.stack or []))
+    return repeats
+
+
+def report(view_name, repeats):
+    """Текст о найденных повторах или None, если их нет."""
+    if not repeats:
+        return None
+    return '\n'.join([f'{view_name}: повторяющиеся запросы к базе']
+                     + [repeat.describe() for repeat in repeats])
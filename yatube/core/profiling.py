@@ -0,0 +1,185 @@
+"""Профилирование запросов: SQL, шаблоны и кэш в Server-Timing и логе.
+
+ProfilingMiddleware (core.middleware) заводит RequestProfile для доли
+запросов PROFILING_SAMPLE_RATE, и пока готовится ответ, в профиль
+пишут:
+
+* обёртка execute_wrapper на всех соединениях — число и время SQL;
+* бэкенд шаблонов DjangoTemplates — время рендера шаблонов верхнего
+  уровня, вложенный render_to_string дважды не считается;
+* обёртка profiled_cache над бэкендом кэша из PROFILED_BACKEND —
+  попадания и промахи get и get_many.
+
+Вне выборки бэкенды только заглядывают в thread-local и сразу идут
+дальше. Время шаблонов включает SQL, выполненный во время рендера.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+from django.template.backends import django as django_backend
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+MISSING = object()
+
+
+def current():
+    """Профиль текущего запроса или None, если он не попал в выборку."""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def detached():
+    """Временно отключает профиль, чтобы не считать одно и то же дважды."""
+    profile = current()
+    _local.profile = None
+    try:
+        yield profile
+    finally:
+        _local.profile = profile
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+class RequestProfile:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total_time = 0.0
+        self.stack = ExitStack()
+
+    def __enter__(self):
+        for alias in connections:
+            self.stack.enter_context(
+                connections[alias].execute_wrapper(self.execute))
+        _local.profile = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.total_time = time.perf_counter() - self.start
+        _local.profile = None
+        self.stack.close()
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_time += time.perf_counter() - start
+
+    @contextmanager
+    def template(self):
+        self.template_depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.template_depth -= 1
+            if not self.template_depth:
+                self.template_time += time.perf_counter() - start
+
+    def cache_lookup(self, hits, misses):
+        self.cache_hits += hits
+        self.cache_misses += misses
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing (только ASCII)."""
+        return ', '.join((
+            f'sql;dur={milliseconds(self.sql_time)};'
+            f'desc="{self.sql_count} queries"',
+            f'tpl;dur={milliseconds(self.template_time)};desc="templates"',
+            f'cache;desc="{self.cache_hits} hits, '
+            f'{self.cache_misses} misses"',
+            f'total;dur={milliseconds(self.total_time)}',
+        ))
+
+    def fields(self, request, response):
+        match = request.resolver_match
+        return {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': milliseconds(self.total_time),
+            'sql_ms': milliseconds(self.sql_time),
+            'sql_count': self.sql_count,
+            'template_ms': milliseconds(self.template_time),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+    def log(self, request, response):
+        """Пишет замеры одной строкой JSON в лог core.profiling."""
+        logger.info(json.dumps(self.fields(request, response),
+                               ensure_ascii=False))
+
+
+class Template(django_backend.Template):
+
+    def render(self, context=None, request=None):
+        profile = current()
+        if profile is None:
+            return super().render(context, request)
+        with profile.template():
+            return super().render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Штатный бэкенд шаблонов, замеряющий время рендера."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+class ProfiledCacheMixin:
+    """Считает попадания и промахи кэша в профиль запроса."""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, MISSING, version)
+        profile = current()
+        if profile is not None:
+            found = value is not MISSING
+            profile.cache_lookup(int(found), int(not found))
+        return default if value is MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        # Штатный get_many может сам вызывать get по каждому ключу.
+        with detached() as profile:
+            found = super().get_many(keys, version)
+        if profile is not None:
+            profile.cache_lookup(len(found), len(keys) - len(found))
+        return found
+
+
+@functools.lru_cache(maxsize=None)
+def profiled_backend(path):
+    backend = import_string(path)
+    return type(f'Profiled{backend.__name__}', (ProfiledCacheMixin, backend),
+                {})
+
+
+def profiled_cache(location, params):
+    """Бэкенд кэша для CACHES: настоящий из PROFILED_BACKEND со счётом
+    попаданий и промахов, так что замеры не зависят от выбора кэша."""
+    return profiled_backend(params['PROFILED_BACKEND'])(location, params)
@@ -0,0 +1,20 @@
+from django.test.runner import DiscoverRunner as BaseDiscoverRunner
+from django.test.utils import override_settings
+
+
+class DiscoverRunner(BaseDiscoverRunner):
+    """Штатный прогон тестов без выборочного профилирования.
+
+    Профилируемые запросы выбираются случайно, и строки профилей меняли
+    бы вывод тестов от прогона к прогону. Тесты профилирования включают
+    его сами через override_settings.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(PROFILING_SAMPLE_RATE=0)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
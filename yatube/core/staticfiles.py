@@ -0,0 +1,80 @@
+"""Хранилище статики с хэшами в именах и заранее сжатыми копиями.
+
+collectstatic раскладывает файлы под именами с хэшем содержимого
+(style.3b1a2c4d5e6f.css), так что их можно кэшировать навсегда, и кладёт
+рядом .gz, а если установлен пакет brotli, то и .br. Сжатие идёт пулом
+потоков: zlib и brotli отпускают GIL. Отдаёт такие файлы
+core.views.serve_static, выбирая копию по Accept-Encoding.
+"""
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Уже сжатые форматы повторно жать бессмысленно.
+COMPRESSIBLE = {'.css', '.js', '.map', '.json', '.svg', '.txt', '.html',
+                '.xml', '.ico', '.eot', '.ttf', '.otf'}
+# Сжатая копия нужна, только если она заметно меньше оригинала.
+MIN_RATIO = 0.95
+
+
+def compress_gzip(data):
+    # mtime=0: одинаковый файл даёт одинаковый архив при каждой сборке.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(data):
+    return brotli.compress(data)
+
+
+def encoders():
+    """Расширения сжатых копий и функции, которые их готовят."""
+    found = {'.gz': compress_gzip}
+    if brotli is not None:
+        found['.br'] = compress_brotli
+    return found
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = [name for name in self.hashed_files.values()
+                 if os.path.splitext(name)[1].lower() in COMPRESSIBLE]
+        with ThreadPoolExecutor(settings.STATIC_COMPRESS_WORKERS) as pool:
+            for name, written in zip(names, pool.map(self.compress, names)):
+                for compressed in written:
+                    yield name, compressed, True
+
+    def compress(self, name):
+        """Пишет сжатые копии файла; возвращает их имена."""
+        path = self.path(name)
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < settings.STATIC_COMPRESS_MIN_SIZE:
+            return []
+        written = []
+        for extension, encode in encoders().items():
+            compressed = encode(data)
+            if len(compressed) > len(data) * MIN_RATIO:
+                continue
+            with open(path + extension, 'wb') as file:
+                file.write(compressed)
+            written.append(name + extension)
+        return written
+
+    def stored_name(self, name):
+        # Пока collectstatic не запускали (разработка, тесты), манифеста
+        # нет и ссылки ведут на исходные имена.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
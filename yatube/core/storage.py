@@ -0,0 +1,100 @@
+"""Файловое хранилище с адресацией по содержимому.
+
+Имя файла — SHA-256 его содержимого, поэтому одинаковые картинки
+хранятся один раз: повторная загрузка получает имя уже лежащего файла.
+Хэш считается по ходу записи во временный файл в том же каталоге,
+который затем атомарно переименовывается.
+
+Файлы раскладываются по подкаталогам из первых символов хэша
+(posts/ab/cd/abcd….jpg), чтобы ни в одном каталоге не копились
+миллионы записей. Старые плоские имена продолжают открываться как есть.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+BLOCK_SIZE = 64 * 1024
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sharded_name(directory, digest, filename):
+    """Путь с двумя уровнями подкаталогов из начала хэша."""
+    return os.path.join(directory, digest[:2], digest[2:4], filename)
+
+
+def is_sharded(name):
+    parts = name.split('/')
+    return (len(parts) >= 4 and len(parts[-3]) == 2 and len(parts[-2]) == 2
+            and parts[-1].startswith(parts[-3] + parts[-2]))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def hashed_name(self, directory, digest, extension):
+        return sharded_name(directory, digest, f'{digest}{extension}')
+
+    def get_available_name(self, name, max_length=None):
+        # Окончательное имя зависит от содержимого и выбирается в _save.
+        return name
+
+    def _save(self, name, content):
+        directory, basename = os.path.split(name)
+        extension = os.path.splitext(basename)[1].lower()
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+        if hasattr(content, 'temporary_file_path'):
+            # Файл уже на диске: хэшируем и переносим без копирования.
+            source = content.temporary_file_path()
+            name = self.hashed_name(directory, file_digest(source),
+                                    extension)
+            if self.exists(name):
+                self.touch(name)
+            else:
+                self.place(source, name, move=True)
+            return name
+        digest = hashlib.sha256()
+        descriptor, temp_path = tempfile.mkstemp(dir=full_directory,
+                                                 suffix='.upload')
+        try:
+            with os.fdopen(descriptor, 'wb') as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+            name = self.hashed_name(directory, digest.hexdigest(), extension)
+            if self.exists(name):
+                os.remove(temp_path)
+                self.touch(name)
+            else:
+                self.place(temp_path, name)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+    def place(self, source, name, move=False):
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if move:
+            file_move_safe(source, full_path, allow_overwrite=True)
+        else:
+            os.replace(source, full_path)
+        # mkstemp создаёт файл с правами 0600.
+        os.chmod(full_path, self.file_permissions_mode or 0o644)
+
+    def touch(self, name):
+        # Переиспользованный файл снова свежий: сборщик мусора
+        # (collect_media) не трогает файлы моложе --min-age.
+        os.utime(self.path(name))
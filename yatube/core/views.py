@@ -1,4 +1,28 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified, StreamingHttpResponse)
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+# Имена из хэша содержимого (картинки постов, их варианты, миниатюры
+# sorl) никогда не указывают на другой файл, их можно кэшировать навсегда.
+HASHED_NAME = re.compile(r'^[0-9a-f]{32,}(-\d+)?$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOCK_SIZE = 64 * 1024
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Хэш, который ManifestStaticFilesStorage вставляет в имя файла.
+STATIC_HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^.]+$')
+# Сжатые копии статики в порядке предпочтения.
+STATIC_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
 
 
 def page_not_found(request, exception):
@@ -7,3 +31,195 @@ def page_not_found(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+def media_etag(path, stat):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if HASHED_NAME.match(stem):
+        return f'"{stem}"'
+    return f'W/"{int(stat.st_mtime)}-{stat.st_size}"'
+
+
+def byte_range(header, size):
+    """Один диапазон из заголовка Range: (начало, конец включительно).
+
+    None — отдать файл целиком, ValueError — диапазон вне файла.
+    """
+    match = RANGE.match(header or '')
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def read_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            block = file.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        file.close()
+
+
+def not_modified(request, etag, stat):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in (tag.strip() for tag in if_none_match.split(','))
+    return not was_modified_since(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime,
+        stat.st_size)
+
+
+@require_safe
+def serve_media(request, path):
+    """Отдаёт файл из MEDIA_ROOT вместо django.views.static.serve.
+
+    Если настроен фронтовой сервер, передача файла поручается ему через
+    X-Accel-Redirect (nginx) или X-Sendfile (Apache, lighttpd), а здесь
+    остаются только проверки и заголовки. Иначе файл отдаётся потоком с
+    поддержкой Range и условных запросов.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    etag = media_etag(full_path, stat)
+    immutable = not etag.startswith('W/')
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': (IMMUTABLE if immutable else
+                          f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'),
+        'Accept-Ranges': 'bytes',
+    }
+    content_type = (mimetypes.guess_type(full_path)[0]
+                    or 'application/octet-stream')
+    if not_modified(request, etag, stat):
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_X_ACCEL_PREFIX:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = (settings.MEDIA_X_ACCEL_PREFIX
+                                        + quote(path))
+    elif settings.MEDIA_X_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = file_response(request, full_path, stat.st_size,
+                                 content_type, etag)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def file_response(request, full_path, size, content_type, etag):
+    header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if header and if_range and if_range != etag:
+        header = None
+    try:
+        span = byte_range(header, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if span is None:
+        return FileResponse(open(full_path, 'rb'),
+                            content_type=content_type)
+    start, end = span
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        read_range(open(full_path, 'rb'), start, length),
+        status=206, content_type=content_type,
+    )
+    response['Content-Length'] = length
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding, кроме явно запрещённых q=0."""
+    accepted = set()
+    for item in (header or '').split(','):
+        coding, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def precompressed(request, full_path):
+    """Путь к подходящей сжатой копии и её кодировка, если она есть."""
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING'))
+    for encoding, extension in STATIC_ENCODINGS:
+        if ((encoding in accepted or '*' in accepted)
+                and os.path.isfile(full_path + extension)):
+            return full_path + extension, encoding
+    return full_path, None
+
+
+@require_safe
+def serve_static(request, path):
+    """Отдаёт собранную collectstatic статику из STATIC_ROOT.
+
+    Выбирает заранее сжатую копию по Accept-Encoding, а файлы с хэшем в
+    имени разрешает кэшировать навсегда.
+    """
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    served_path, encoding = precompressed(request, full_path)
+    stat = os.stat(served_path)
+    etag = media_etag(served_path, stat)
+    response_headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': (
+            IMMUTABLE if STATIC_HASHED_NAME.search(path) else
+            f'public, max-age={settings.STATIC_CACHE_MAX_AGE}'
+        ),
+        'Accept-Ranges': 'bytes',
+        'Vary': 'Accept-Encoding',
+    }
+    if not_modified(request, etag, stat):
+        response = HttpResponseNotModified()
+    else:
+        content_type = (mimetypes.guess_type(full_path)[0]
+                        or 'application/octet-stream')
+        response = file_response(request, served_path, stat.st_size,
+                                 content_type, etag)
+        if encoding and response.status_code != 416:
+            response['Content-Encoding'] = encoding
+            # FileResponse угадывает тип по имени копии (.gz).
+            response['Content-Type'] = content_type
+    for header, value in response_headers.items():
+        response[header] = value
+    return response
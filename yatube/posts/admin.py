@@ -1,15 +1,32 @@
 from django.contrib import admin
 
 from .models import Group, Post, Comment, Follow
+from .search import fts_available, match_expression, matching_ids
 
 
-class PostAdmin(admin.ModelAdmin):
+class FullTextSearchMixin:
+    """Поиск в админке через FTS5-индекс вместо LIKE '%...%'."""
+
+    search_comments = False
+
+    def get_search_results(self, request, queryset, search_term):
+        if not fts_available() or not search_term.strip():
+            return super().get_search_results(request, queryset,
+                                              search_term)
+        if not match_expression(search_term):
+            return queryset.none(), False
+        ids = matching_ids(search_term, comments=self.search_comments)
+        return queryset.filter(pk__in=ids), False
+
+
+class PostAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = (
         'pk',
         'text',
         'pub_date',
         'author',
         'group',
+        'comments_count',
     )
     list_editable = ('group',)
     search_fields = ('text',)
@@ -29,7 +46,8 @@ class GroupAdmin(admin.ModelAdmin):
     list_filter = ('title',)
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    search_comments = True
     list_display = (
         'pk',
         'text',
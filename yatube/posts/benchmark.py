@@ -0,0 +1,126 @@
+"""Замер представлений постов через тестовый клиент.
+
+Каждый сценарий прогоняется requests раз на случайных, но
+воспроизводимых целях: посты и группы берутся равномерно, а авторы —
+вслед за постами, так что активные авторы попадаются чаще. Для
+каждого представления считаются p50/p95 времени ответа, число запросов
+к базе и размер ответа.
+"""
+import math
+import random
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max, Min
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Follow, Group, Post
+
+
+def percentile(values, fraction):
+    """Значение по рангу: доля fraction выборки не больше него."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def random_rows(queryset, count, rng):
+    """Примерно count случайных строк по диапазону первичных ключей."""
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return []
+    pks = [rng.randint(bounds['low'], bounds['high']) for _ in range(count)]
+    return list(queryset.filter(pk__in=pks))
+
+
+class Targets:
+    """Случайные посты и читатели лент, по которым ходят сценарии."""
+
+    def __init__(self, count, rng):
+        self.posts = random_rows(
+            Post.objects.select_related('author', 'group'), count, rng)
+        self.readers = [follow.user for follow in random_rows(
+            Follow.objects.select_related('user'), count, rng)]
+        self.groups = random_rows(Group.objects.all(), count, rng)
+        if not (self.posts and self.readers and self.groups):
+            raise ValueError('В базе нет постов, групп или подписок.')
+        self.rng = rng
+
+    def post(self):
+        return self.rng.choice(self.posts)
+
+    def reader(self):
+        return self.rng.choice(self.readers)
+
+
+# Сценарии: имя → функция, которая по целям выдаёт
+# (пользователь или None, метод, адрес, данные формы).
+SCENARIOS = {
+    'index': lambda targets: (
+        None, 'get', reverse('posts:index'), None),
+    'group_posts': lambda targets: (
+        None, 'get',
+        reverse('posts:group_list',
+                args=[targets.rng.choice(targets.groups).slug]),
+        None),
+    'profile': lambda targets: (
+        None, 'get',
+        reverse('posts:profile', args=[targets.post().author.username]),
+        None),
+    'post_detail': lambda targets: (
+        None, 'get',
+        reverse('posts:post_detail', args=[targets.post().pk]), None),
+    'follow_index': lambda targets: (
+        targets.reader(), 'get', reverse('posts:follow_index'), None),
+    'post_create': lambda targets: (
+        targets.reader(), 'post', reverse('posts:post_create'),
+        {'text': 'Пост из замера'}),
+    'add_comment': lambda targets: (
+        targets.reader(), 'post',
+        reverse('posts:add_comment', args=[targets.post().pk]),
+        {'text': 'Комментарий из замера'}),
+}
+
+
+def measure(scenario, targets, requests, cold=False):
+    """Прогоняет сценарий и возвращает сводку замеров."""
+    client = Client()
+    logged_in = None
+    timings, queries, sizes = [], [], []
+    for _ in range(requests):
+        user, method, url, data = scenario(targets)
+        if user != logged_in:
+            if user is None:
+                client.logout()
+            else:
+                client.force_login(user)
+            logged_in = user
+        if cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError(f'{url}: {response.status_code}')
+        timings.append(elapsed * 1000)
+        queries.append(len(captured))
+        sizes.append(len(response.content))
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'queries_p50': percentile(queries, 0.5),
+        'queries_max': max(queries),
+        'bytes_p50': percentile(sizes, 0.5),
+    }
+
+
+def run(requests, seed=0, cold=False, names=None):
+    """Замеры всех (или перечисленных в names) сценариев."""
+    targets = Targets(requests, random.Random(seed))
+    return {name: measure(scenario, targets, requests, cold)
+            for name, scenario in SCENARIOS.items()
+            if not names or name in names}
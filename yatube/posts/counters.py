@@ -0,0 +1,59 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Follow, Post, UserStats
+
+
+def live_stats(user_id):
+    """Счётчики пользователя, посчитанные по живым таблицам."""
+    return {
+        'posts_count': Post.objects.filter(author_id=user_id).count(),
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def get_stats(user):
+    """Запись счётчиков пользователя; создаётся по живым данным."""
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        stats, _ = UserStats.objects.get_or_create(
+            user=user, defaults=live_stats(user.pk)
+        )
+        return stats
+
+
+def increment(user_id, **deltas):
+    """Атомарно сдвигает счётчики; недостающую запись строит заново."""
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                UserStats.objects.create(user_id=user_id,
+                                         **live_stats(user_id))
+        except IntegrityError:
+            pass
+
+
+def decrement(user_id, **deltas):
+    """Атомарно уменьшает счётчики, не опуская их ниже нуля."""
+    UserStats.objects.filter(user_id=user_id).update(
+        **{field: Greatest(F(field) - delta, 0)
+           for field, delta in deltas.items()}
+    )
+
+
+def increment_comments(post_id):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=F('comments_count') + 1
+    )
+
+
+def decrement_comments(post_id):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=Greatest(F('comments_count') - 1, 0)
+    )
@@ -0,0 +1,55 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from . import versions
+
+
+def conditional_page(scopes):
+    """Отдаёт ETag/Last-Modified по версиям кэша и 304 на совпадение.
+
+    scopes(request, *args, **kwargs) возвращает ключи версий областей,
+    из которых собрана страница; сама страница для проверки не
+    рендерится. ETag учитывает пользователя и его CSRF-секрет, чтобы
+    персональная разметка не досталась другому посетителю. Для
+    авторизованных Last-Modified не отдаётся: время изменения ленты не
+    различает, кто смотрел страницу.
+    """
+    def page_versions(request, *args, **kwargs):
+        if not hasattr(request, 'page_versions'):
+            request.page_versions = versions.get_versions(
+                *scopes(request, *args, **kwargs)
+            )
+        return request.page_versions
+
+    def etag(request, *args, **kwargs):
+        parts = [
+            *page_versions(request, *args, **kwargs),
+            request.get_full_path(),
+            str(request.user.pk),
+            request.META.get('CSRF_COOKIE', ''),
+        ]
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        return versions.changed_at(page_versions(request, *args, **kwargs))
+
+    def decorator(view):
+        conditional_view = condition(etag, last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            patch_vary_headers(response, ('Cookie',))
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(response, max_age=0,
+                                    must_revalidate=True)
+            return response
+        return wrapper
+    return decorator
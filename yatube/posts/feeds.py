@@ -0,0 +1,72 @@
+from django.conf import settings
+
+from . import versions
+from .models import FeedEntry, Follow, Post
+from .utils import batches
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора.
+
+    Кэш этих лент сбрасывается тут же, за тот же проход по подписчикам.
+    """
+    followers = (Follow.objects
+                 .filter(author_id=post.author_id)
+                 .values_list('user_id', flat=True)
+                 .iterator())
+    for batch in batches(followers, settings.FEED_BATCH_SIZE):
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+             for user_id in batch],
+            ignore_conflicts=True,
+        )
+        versions.bump(*(versions.feed_key(user_id) for user_id in batch))
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика уже опубликованные посты автора."""
+    posts = (Post.objects
+             .filter(author_id=author_id)
+             .values_list('pk', 'pub_date')
+             .iterator())
+    for batch in batches(posts, settings.FEED_BATCH_SIZE):
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+             for post_id, pub_date in batch],
+            ignore_conflicts=True,
+        )
+
+
+def prune(user_id, author_id):
+    """Убирает посты автора из ленты бывшего подписчика."""
+    FeedEntry.objects.filter(user_id=user_id,
+                             post__author_id=author_id).delete()
+
+
+def stale_entries(user_id):
+    """Записи ленты, которых нет в живой выборке через подписки."""
+    return (FeedEntry.objects
+            .filter(user_id=user_id)
+            .exclude(post__author__following__user_id=user_id))
+
+
+def missing_posts(user_id):
+    """Посты из живой выборки через подписки, которых нет в ленте."""
+    return (Post.objects
+            .filter(author__following__user_id=user_id)
+            .exclude(feed_entries__user_id=user_id))
+
+
+def repair(user_id):
+    """Приводит ленту к живой выборке. Возвращает (добавлено, удалено)."""
+    removed, _ = stale_entries(user_id).delete()
+    added = 0
+    posts = missing_posts(user_id).values_list('pk', 'pub_date').iterator()
+    for batch in batches(posts, settings.FEED_BATCH_SIZE):
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+             for post_id, pub_date in batch],
+            ignore_conflicts=True,
+        )
+        added += len(batch)
+    return added, removed
@@ -0,0 +1,302 @@
+"""Обработка картинок постов: приём загрузки и адаптивные варианты.
+
+При загрузке картинка проверяется по размеру файла и числу пикселей
+ещё до декодирования, а слишком крупная или несущая метаданные
+пересохраняется уменьшенной и очищенной.
+
+Для каждой картинки готовится несколько ширин в современных форматах
+(AVIF, если его умеет Pillow, WebP) и в JPEG для старых браузеров.
+Описание вариантов хранится в Post.image_variants, так что шаблоны
+строят srcset, не обращаясь к файловой системе.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps, ImageSequence
+
+from core.storage import sharded_name
+
+try:
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Формат варианта: (кодек Pillow, MIME-тип, расширение файла).
+FORMATS = {
+    'avif': ('AVIF', 'image/avif', 'avif'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+}
+VARIANTS_DIR = 'posts/variants/'
+PLACEHOLDER_WIDTH = 16
+# Значения EXIF Orientation, при которых картинка повёрнута на 90°.
+ROTATED = {5, 6, 7, 8}
+EXIF_ORIENTATION = 0x0112
+# Единственные ключи Image.info, которые переживают загрузку: всё
+# остальное (EXIF, XMP, текстовые блоки PNG с геометками и т. п.)
+# выбрасывается пересохранением.
+KEPT_INFO = {'icc_profile', 'transparency'}
+# Числовые параметры заголовков, которые Pillow кладёт в info при
+# чтении: это не метаданные, из-за них картинку не пересохраняем, но и
+# не переносим. Любой другой ключ — повод пересохранить.
+HEADER_INFO = {'jfif', 'jfif_version', 'jfif_unit', 'jfif_density', 'dpi',
+               'progressive', 'progression', 'adobe', 'adobe_transform',
+               'version', 'background', 'duration', 'loop', 'gamma',
+               'srgb', 'aspect'}
+# Параметры пересохранения по форматам исходника.
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 85},
+}
+
+
+def supported_formats():
+    """Форматы из POSTS_IMAGE_FORMATS, которые умеет писать Pillow."""
+    Image.init()
+    return [name for name in settings.POSTS_IMAGE_FORMATS
+            if FORMATS[name][0] in Image.SAVE]
+
+
+def ingest(upload):
+    """Проверяет и нормализует загруженную картинку.
+
+    Лимиты по байтам и пикселям проверяются по заголовку, до полного
+    декодирования. Картинка, которую не нужно ни уменьшать, ни
+    поворачивать, ни чистить, возвращается как есть, байт в байт.
+    Из MPO камер берётся только первый кадр, он сохраняется как JPEG.
+    """
+    if upload.size > settings.POSTS_IMAGE_MAX_BYTES:
+        raise ValidationError(
+            'Файл больше %(limit)d МБ.',
+            code='file_too_large',
+            params={'limit': settings.POSTS_IMAGE_MAX_BYTES // 2 ** 20},
+        )
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    if width * height > settings.POSTS_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Картинка больше %(limit)d мегапикселей.',
+            code='too_many_pixels',
+            params={'limit': settings.POSTS_IMAGE_MAX_PIXELS // 10 ** 6},
+        )
+    # MPO — JPEG с дополнительными кадрами (стереопара, превью),
+    # Pillow считает его анимацией, но показывается только первый кадр.
+    multi_picture = image.format == 'MPO'
+    if getattr(image, 'is_animated', False) and not multi_picture:
+        return clean_animation(image, upload)
+    max_size = settings.POSTS_IMAGE_MAX_SIZE
+    oversized = max(width, height) > max_size
+    rotated = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+    metadata = set(image.info) - KEPT_INFO - HEADER_INFO
+    if not (oversized or rotated or metadata or multi_picture):
+        upload.seek(0)
+        return upload
+    image_format = 'JPEG' if multi_picture else image.format
+    kept = {key: value for key, value in image.info.items()
+            if key in KEPT_INFO}
+    # thumbnail() сам включает draft-режим JPEG, так что огромная
+    # фотография декодируется уже уменьшенной. Рамка квадратная,
+    # поэтому поворот можно сделать после уменьшения.
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    image = ImageOps.exif_transpose(image)
+    if image_format == 'JPEG':
+        kept.pop('transparency', None)
+        if image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+    # Пишутся только разрешённые ключи, а не всё, что осталось в info.
+    image.info = {}
+    options = {**SAVE_OPTIONS.get(image_format, {}), **kept}
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return SimpleUploadedFile(upload.name, buffer.getvalue(),
+                              content_type=upload.content_type)
+
+
+def clean_animation(image, upload):
+    """Проверяет размер анимации и убирает из неё метаданные.
+
+    Уменьшать анимацию покадрово дорого, поэтому слишком крупная
+    отклоняется. Если метаданных нет, файл возвращается как есть, иначе
+    кадры пересохраняются с прежними длительностями и повтором.
+    """
+    max_size = settings.POSTS_IMAGE_MAX_SIZE
+    if max(image.size) > max_size:
+        raise ValidationError(
+            'Анимация больше %(limit)d точек по длинной стороне.',
+            code='animation_too_large',
+            params={'limit': max_size},
+        )
+    if not set(image.info) - KEPT_INFO - HEADER_INFO:
+        upload.seek(0)
+        return upload
+    image_format = image.format
+    options = {key: value for key, value in image.info.items()
+               if key in KEPT_INFO or key == 'loop'}
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(image):
+        durations.append(frame.info.get('duration', 0))
+        frame = frame.copy()
+        frame.info = {}
+        frames.append(frame)
+    buffer = io.BytesIO()
+    frames[0].save(buffer, image_format, save_all=True,
+                   append_images=frames[1:], duration=durations, **options)
+    return SimpleUploadedFile(upload.name, buffer.getvalue(),
+                              content_type=upload.content_type)
+
+
+def crop_to_ratio(image, ratio):
+    """Обрезает картинку по центру до соотношения сторон ratio."""
+    width, height = image.size
+    if width / height > ratio:
+        new_width = round(height * ratio)
+        left = (width - new_width) // 2
+        return image.crop((left, 0, left + new_width, height))
+    new_height = round(width / ratio)
+    top = (height - new_height) // 2
+    return image.crop((0, top, width, top + new_height))
+
+
+def variant_widths(width):
+    """Ширины вариантов не больше исходной, но хотя бы одна."""
+    widths = [value for value in settings.POSTS_IMAGE_WIDTHS
+              if value <= width]
+    return widths or [width]
+
+
+def variant_name(name, width, extension):
+    """Имя варианта картинки name: <основа>-<ширина>.<расширение>."""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    shard_key = hashlib.md5(stem.encode()).hexdigest()
+    return sharded_name(VARIANTS_DIR, shard_key,
+                        f'{stem}-{width}.{extension}')
+
+
+def build_variants(name):
+    """Режет и сохраняет варианты картинки; возвращает их описание."""
+    ratio = settings.POSTS_IMAGE_RATIO
+    with default_storage.open(name) as source:
+        image = Image.open(source)
+        # Для JPEG декодер сразу уменьшает картинку в 2-8 раз, если
+        # самый крупный вариант это позволяет.
+        largest = max(settings.POSTS_IMAGE_WIDTHS)
+        image.draft('RGB', (largest, round(largest / ratio)))
+        image = ImageOps.exif_transpose(image)
+    image = crop_to_ratio(image.convert('RGB'), ratio)
+    variants = {}
+    for format_name in supported_formats():
+        codec, _, extension = FORMATS[format_name]
+        entries = []
+        for width in variant_widths(image.width):
+            height = max(round(width / ratio), 1)
+            target = variant_name(name, width, extension)
+            # Основа имени — хэш содержимого оригинала, так что готовый
+            # вариант с тем же именем подходит как есть, а повторное
+            # сохранение дало бы дубликат с суффиксом.
+            if not default_storage.exists(target):
+                resized = image.resize((width, height), Image.LANCZOS)
+                buffer = io.BytesIO()
+                resized.save(buffer, codec,
+                             quality=settings.POSTS_IMAGE_QUALITY)
+                target = default_storage.save(
+                    target, ContentFile(buffer.getvalue()))
+            entries.append({'name': target, 'width': width,
+                            'height': height})
+        variants[format_name] = entries
+    return variants
+
+
+def describe(file):
+    """Размеры картинки и крошечная заглушка для ленивой загрузки.
+
+    Размеры берутся из заголовка с учётом EXIF-поворота, а JPEG для
+    заглушки декодируется сразу в уменьшенном виде. Возвращает
+    (ширина, высота, data URI заглушки).
+    """
+    file.seek(0)
+    image = Image.open(file)
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION) in ROTATED:
+        width, height = height, width
+    ratio = settings.POSTS_IMAGE_RATIO
+    image.draft('RGB', (PLACEHOLDER_WIDTH * 4,
+                        round(PLACEHOLDER_WIDTH * 4 / ratio)))
+    image = crop_to_ratio(ImageOps.exif_transpose(image).convert('RGB'),
+                          ratio)
+    image = image.resize((PLACEHOLDER_WIDTH,
+                          max(round(PLACEHOLDER_WIDTH / ratio), 1)),
+                         Image.BILINEAR)
+    format_name = 'webp' if 'WEBP' in Image.SAVE else 'jpeg'
+    codec, mime_type, _ = FORMATS[format_name]
+    buffer = io.BytesIO()
+    image.save(buffer, codec, quality=40)
+    file.seek(0)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return width, height, f'data:{mime_type};base64,{encoded}'
+
+
+def fill_metadata(post):
+    """Заполняет размеры и заглушку по загруженному файлу картинки."""
+    if not post.image:
+        post.image_width = post.image_height = None
+        post.image_placeholder = ''
+        return
+    try:
+        (post.image_width, post.image_height,
+         post.image_placeholder) = describe(post.image.file)
+    except (OSError, SyntaxError, ValueError):
+        post.image_width = post.image_height = None
+        post.image_placeholder = ''
+
+
+def load_variants(post):
+    if not post.image_variants:
+        return {}
+    return json.loads(post.image_variants)
+
+
+def delete_variants(raw):
+    """Удаляет файлы вариантов по сохранённому описанию."""
+    if not raw:
+        return
+    for entries in json.loads(raw).values():
+        for entry in entries:
+            default_storage.delete(entry['name'])
+
+
+def srcset(entries):
+    return ', '.join(f'{default_storage.url(entry["name"])} {entry["width"]}w'
+                     for entry in entries)
+
+
+def picture_sources(post):
+    """Данные для <picture>: источники по форматам и запасной JPEG.
+
+    Возвращает None, если варианты ещё не готовы.
+    """
+    variants = load_variants(post)
+    fallback = variants.get('jpeg')
+    if not fallback:
+        return None
+    sources = [{'type': FORMATS[name][1], 'srcset': srcset(entries)}
+               for name, entries in variants.items()
+               if name != 'jpeg' and entries]
+    largest = fallback[-1]
+    return {
+        'sources': sources,
+        'src': default_storage.url(largest['name']),
+        'srcset': srcset(fallback),
+        'width': largest['width'],
+        'height': largest['height'],
+    }
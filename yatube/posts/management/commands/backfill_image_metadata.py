@@ -0,0 +1,37 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from posts.images import describe
+from posts.models import Post
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ('Заполняет размеры и заглушки у картинок постов, '
+            'загруженных до их появления.')
+
+    def handle(self, *args, **options):
+        filled = failed = 0
+        posts = (Post.objects
+                 .exclude(image='')
+                 .filter(image_width__isnull=True)
+                 .order_by('pk'))
+        chunk = list(posts[:CHUNK_SIZE])
+        while chunk:
+            for post in chunk:
+                try:
+                    with default_storage.open(post.image.name) as file:
+                        (post.image_width, post.image_height,
+                         post.image_placeholder) = describe(file)
+                except (OSError, SyntaxError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(f'post={post.pk}: {error}')
+                    continue
+                post.save(update_fields=('image_width', 'image_height',
+                                         'image_placeholder', 'updated'))
+                filled += 1
+            chunk = list(posts.filter(pk__gt=chunk[-1].pk)[:CHUNK_SIZE])
+        self.stdout.write(self.style.SUCCESS(
+            f'Заполнено картинок: {filled}, с ошибками: {failed}'
+        ))
@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from posts.models import Comment, Post
+from posts.search import SearchResults, fts_available
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск через FTS5 с поиском через LIKE '
+            '(так, как искала админка).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='+',
+                            help='Поисковые запросы для замера.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Сколько раз повторить каждый запрос.')
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite.')
+        per_page = settings.POSTS_SHOW_AMOUNT
+        for query in options['queries']:
+            results = SearchResults(query)
+
+            def fts():
+                return results.count(), results[:per_page]
+
+            def like():
+                match = (Q(text__icontains=query)
+                         | Q(comments__text__icontains=query))
+                posts = Post.objects.filter(match).distinct()
+                return posts.count(), list(posts[:per_page])
+
+            def like_comments():
+                comments = Comment.objects.filter(text__icontains=query)
+                return comments.count(), list(comments[:per_page])
+
+            fts_time = timed(fts, options['repeat'])
+            like_time = timed(like, options['repeat'])
+            like_comments_time = timed(like_comments, options['repeat'])
+            self.stdout.write(
+                f'{query!r}: найдено {results.count()}, '
+                f'FTS5 {fts_time * 1000:.1f} мс, '
+                f'LIKE по постам {like_time * 1000:.1f} мс, '
+                f'LIKE по комментариям {like_comments_time * 1000:.1f} мс'
+            )
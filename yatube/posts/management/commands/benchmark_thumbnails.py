@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
+from sorl.thumbnail import default
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from posts import thumbnails
+from posts.models import Post
+from posts.templatetags.post_cards import CARD_TEMPLATE
+
+
+class Command(BaseCommand):
+    help = ('Считает запросы к базе при рендере страницы карточек с '
+            'картинками: поштучный поиск миниатюр против пачки.')
+
+    def handle(self, *args, **options):
+        kvstore = default.kvstore
+        if not hasattr(kvstore, 'prefetch'):
+            raise CommandError('THUMBNAIL_KVSTORE не поддерживает '
+                               'пакетную загрузку.')
+        posts = list(Post.objects
+                     .select_related('author', 'group')
+                     .exclude(image='')[:settings.POSTS_SHOW_AMOUNT])
+        if not posts:
+            raise CommandError('Нет постов с картинками.')
+        for post in posts:
+            thumbnails.generate(post.image.name, with_variants=False)
+        keys = [add_prefix(thumbnails.thumbnail_key(post.image.name,
+                                                    geometry, options))
+                for post in posts
+                for geometry, options in settings.POSTS_THUMBNAIL_GEOMETRIES]
+
+        def render(prefetch):
+            with CaptureQueriesContext(connection) as queries:
+                if prefetch:
+                    thumbnails.prefetch(posts)
+                for post in posts:
+                    render_to_string(CARD_TEMPLATE, {'post': post})
+            return len(queries)
+
+        def evict():
+            kvstore.cache.delete_many(keys)
+            kvstore.lru.clear()
+
+        evict()
+        one_by_one = render(prefetch=False)
+        evict()
+        batched = render(prefetch=True)
+        warm = render(prefetch=True)
+        self.stdout.write(
+            f'Карточек на странице: {len(posts)}. Запросов при холодном '
+            f'кэше: поштучно {one_by_one}, пачкой {batched}; '
+            f'при тёплом: {warm}'
+        )
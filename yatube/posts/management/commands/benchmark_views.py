@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from posts import benchmark
+from posts.seeding import SCALES, seed
+
+# Замеры идут как в работе: без DEBUG и его промежуточных слоёв
+# (бюджеты запросов, поиск N+1 с обходом стека на каждый запрос,
+# профилирование каждого запроса), которые сами стоят заметного
+# времени.
+PRODUCTION_SETTINGS = {
+    'DEBUG': False,
+    'QUERY_BUDGET_CHECK': False,
+    'NPLUSONE_CHECK': False,
+    'PROFILING_SAMPLE_RATE': 0,
+}
+
+
+class Command(BaseCommand):
+    help = ('Засевает тестовую базу синтетическими данными и замеряет '
+            'представления постов: p50/p95 времени ответа, запросы к '
+            'базе и размер ответа. Итог выводится в JSON, чтобы '
+            'сравнивать прогоны разных коммитов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', dest='scales',
+                            choices=SCALES,
+                            help='Масштаб набора данных; можно несколько. '
+                                 'По умолчанию 10k.')
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Сколько запросов на представление.')
+        parser.add_argument('--view', action='append', dest='views',
+                            choices=benchmark.SCENARIOS,
+                            help='Замерить только это представление.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора данных и целей.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кэш перед каждым запросом.')
+        parser.add_argument('--output',
+                            help='Файл для JSON вместо стандартного вывода.')
+
+    def handle(self, *args, **options):
+        report = {'seed': options['seed'], 'cold': options['cold'],
+                  'database': connection.vendor,
+                  'settings': PRODUCTION_SETTINGS, 'scales': {}}
+        with override_settings(**PRODUCTION_SETTINGS):
+            for name in options['scales'] or ['10k']:
+                report['scales'][name] = self.run_scale(name, options)
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_scale(self, name, options):
+        """Прогон на свежей тестовой базе: рабочую замеры не трогают.
+
+        Тестовая база SQLite по умолчанию живёт в памяти, и замеры не
+        видели бы дискового ввода-вывода, поэтому для неё берётся файл
+        во временном каталоге.
+        """
+        test_settings = connection.settings_dict['TEST']
+        old_test_name = test_settings.get('NAME')
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite' and not old_test_name:
+                test_settings['NAME'] = os.path.join(directory,
+                                                     'benchmark.sqlite3')
+            try:
+                return self.run_on_test_db(name, options)
+            finally:
+                test_settings['NAME'] = old_test_name
+
+    def run_on_test_db(self, name, options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            start = time.perf_counter()
+            dataset = seed(SCALES[name], options['seed'])
+            seeded = time.perf_counter() - start
+            self.stderr.write(f'{name}: данные за {seeded:.1f} с')
+            try:
+                views = benchmark.run(options['requests'], options['seed'],
+                                      options['cold'], options['views'])
+            except (ValueError, RuntimeError) as error:
+                raise CommandError(error)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        return {'dataset': dataset, 'seed_seconds': round(seeded, 1),
+                'views': views}
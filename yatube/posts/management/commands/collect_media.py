@@ -0,0 +1,276 @@
+import os
+import re
+import time
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.validators import get_available_image_extensions
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.storage import sharded_name
+from posts import uploads
+from posts.images import VARIANTS_DIR, load_variants
+from posts.models import ChunkedUpload, Post
+
+# Сколько имён картинок искать одним запросом: SQLite ограничивает
+# число параметров запроса (999 в старых версиях).
+NAMES_PER_QUERY = 900
+# Основа имени, которое дало хранилище по хэшу содержимого.
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+class Throttle:
+    """Не даёт выполнять больше rate операций в секунду."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next = time.monotonic()
+
+    def tick(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next > now:
+            time.sleep(self.next - now)
+        self.next = max(self.next, now) + self.interval
+
+
+class Command(BaseCommand):
+    help = ('Удаляет из MEDIA_ROOT картинки, варианты и миниатюры, на '
+            'которые больше не ссылается ни один пост, устаревшие записи '
+            'sorl-thumbnail и брошенные загрузки по частям.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Сколько файлов сверять одним запросом.')
+        parser.add_argument('--rate', type=float, default=500,
+                            help='Сколько файлов в секунду проверять и '
+                                 'удалять; 0 — без ограничения.')
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Не трогать файлы моложе стольких секунд.')
+        parser.add_argument('--upload-ttl', type=int, default=24 * 60 * 60,
+                            help='Через сколько секунд загрузка по частям '
+                                 'считается брошенной.')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.verbose = options['verbosity'] > 1
+        self.chunk_size = options['chunk_size']
+        self.throttle = Throttle(options['rate'])
+        self.cutoff = time.time() - options['min_age']
+        self.removed = self.freed = 0
+        self.collect_thumbnail_records()
+        self.collect_uploads(options['upload_ttl'])
+        roots = {
+            Post._meta.get_field('image').upload_to: self.referenced_images,
+            thumbnail_settings.THUMBNAIL_PREFIX: self.referenced_thumbnails,
+            settings.POSTS_UPLOAD_DIR: self.referenced_parts,
+        }
+        for root, referenced in roots.items():
+            self.collect_files(root, referenced)
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Можно удалить" if self.dry_run else "Удалено"} файлов: '
+            f'{self.removed}, {self.freed / 2 ** 20:.1f} МБ'
+        ))
+
+    def collect_thumbnail_records(self):
+        """Сбрасывает миниатюры картинок, которых больше нет у постов."""
+        prefix = add_prefix('', 'thumbnails')
+        records = (KVStoreModel.objects
+                   .filter(key__startswith=prefix)
+                   .order_by('key')
+                   .values_list('key', flat=True))
+        stale = 0
+        chunk = list(records[:self.chunk_size])
+        while chunk:
+            source_keys = [key[len(prefix):] for key in chunk]
+            names = {
+                key[len(add_prefix('')):]: deserialize(value)['name']
+                for key, value in KVStoreModel.objects
+                .filter(key__in=[add_prefix(key) for key in source_keys])
+                .values_list('key', 'value')
+            }
+            used = set(Post.objects
+                       .filter(image__in=names.values())
+                       .values_list('image', flat=True))
+            for key in source_keys:
+                if names.get(key) in used:
+                    continue
+                stale += 1
+                self.throttle.tick()
+                if self.verbose:
+                    self.stdout.write(f'Миниатюры: {names.get(key, key)}')
+                if not self.dry_run:
+                    # Удаляет записи и файлы миниатюр, сам исходник
+                    # sorl не трогает.
+                    default.kvstore.delete(SimpleNamespace(key=key))
+            chunk = list(records.filter(key__gt=chunk[-1])
+                         [:self.chunk_size])
+        self.stdout.write(f'Устаревших картинок в sorl-thumbnail: {stale}')
+
+    def collect_uploads(self, ttl):
+        """Удаляет загрузки по частям, начатые раньше ttl секунд назад."""
+        expired = ChunkedUpload.objects.filter(
+            created__lt=timezone.now() - timedelta(seconds=ttl)
+        ).order_by('pk')
+        count = 0
+        chunk = list(expired[:self.chunk_size])
+        while chunk:
+            for upload in chunk:
+                self.throttle.tick()
+                path = uploads.part_path(upload)
+                if os.path.exists(path):
+                    self.remove(path, os.stat(path).st_size, check=False)
+            count += len(chunk)
+            if not self.dry_run:
+                ChunkedUpload.objects.filter(
+                    pk__in=[upload.pk for upload in chunk]).delete()
+            chunk = list(expired.filter(pk__gt=chunk[-1].pk)
+                         [:self.chunk_size])
+        self.stdout.write(f'Брошенных загрузок по частям: {count}')
+
+    def collect_files(self, root, referenced):
+        """Обходит каталог и удаляет файлы, на которые нет ссылок.
+
+        В памяти держится не больше chunk_size файлов: они сверяются с
+        базой пачкой, после чего пачка отпускается.
+        """
+        top = os.path.join(settings.MEDIA_ROOT, root)
+        if not os.path.isdir(top):
+            return
+        batch = []
+        for entry in self.walk(top):
+            self.throttle.tick()
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > self.cutoff:
+                continue
+            name = os.path.relpath(entry.path, settings.MEDIA_ROOT)
+            batch.append((name.replace(os.sep, '/'), entry.path,
+                          stat.st_size))
+            if len(batch) >= self.chunk_size:
+                self.collect_batch(batch, referenced)
+                batch = []
+        if batch:
+            self.collect_batch(batch, referenced)
+
+    def walk(self, path):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.walk(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+    def collect_batch(self, batch, referenced):
+        used = referenced([name for name, _, _ in batch])
+        for name, path, size in batch:
+            if name not in used:
+                if self.verbose:
+                    self.stdout.write(name)
+                self.remove(path, size)
+
+    def remove(self, path, size, check=True):
+        """Удаляет файл, если его не обновили после проверки.
+
+        Хранилище обновляет время изменения файла, когда переиспользует
+        его для новой загрузки с тем же содержимым, поэтому так не
+        пропадёт картинка, на которую ссылка появилась во время обхода.
+        """
+        self.throttle.tick()
+        self.removed += 1
+        self.freed += size
+        if self.dry_run:
+            return
+        try:
+            if check and os.stat(path).st_mtime > self.cutoff:
+                self.removed -= 1
+                self.freed -= size
+                return
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def referenced_images(self, names):
+        originals = [name for name in names
+                     if not name.startswith(VARIANTS_DIR)]
+        used = set(Post.objects
+                   .filter(image__in=originals)
+                   .values_list('image', flat=True))
+        variants = [name for name in names if name.startswith(VARIANTS_DIR)]
+        return used | self.referenced_variants(variants)
+
+    def referenced_variants(self, names):
+        """Варианты, перечисленные в image_variants какого-нибудь поста.
+
+        Имя варианта — <основа>-<ширина>.<расширение>, где основа — имя
+        оригинала без расширения. По основе восстанавливаются возможные
+        имена оригинала, посты ищутся по индексу image, а точный список
+        вариантов берётся из их описания.
+        """
+        stems = sorted({os.path.basename(name).rsplit('-', 1)[0]
+                        for name in names})
+        candidates = [name for stem in stems
+                      for name in self.original_names(stem)]
+        used = set()
+        for start in range(0, len(candidates), NAMES_PER_QUERY):
+            posts = Post.objects.filter(
+                image__in=candidates[start:start + NAMES_PER_QUERY]
+            ).only('image_variants')
+            for post in posts:
+                used.update(entry['name']
+                            for entries in load_variants(post).values()
+                            for entry in entries)
+        return used & set(names)
+
+    @staticmethod
+    def original_names(stem):
+        """Имена, под которыми мог лежать оригинал с такой основой.
+
+        Расширение — любое из тех, что принимает ImageField. Хранилище
+        пишет его строчными буквами в каталог по хэшу, а у старых
+        плоских имён оно осталось таким, каким было при загрузке.
+        """
+        directory = Post._meta.get_field('image').upload_to
+        extensions = get_available_image_extensions()
+        if DIGEST.match(stem):
+            return [sharded_name(directory, stem, f'{stem}.{extension}')
+                    for extension in extensions]
+        return [f'{directory}{stem}.{extension}'
+                for lower in extensions
+                for extension in (lower, lower.upper())]
+
+    def referenced_thumbnails(self, names):
+        """Файлы миниатюр, о которых знает хранилище sorl-thumbnail."""
+        keys = {add_prefix(ImageFile(name, default.storage).key): name
+                for name in names}
+        return {keys[key]
+                for key in KVStoreModel.objects
+                .filter(key__in=keys)
+                .values_list('key', flat=True)}
+
+    def referenced_parts(self, names):
+        ids = {os.path.splitext(os.path.basename(name))[0]: name
+               for name in names if name.endswith('.part')}
+        return {ids[str(pk)]
+                for pk in ChunkedUpload.objects
+                .filter(pk__in=[value for value in ids
+                                if self.is_uuid(value)])
+                .values_list('pk', flat=True)}
+
+    @staticmethod
+    def is_uuid(value):
+        try:
+            return str(uuid.UUID(value)) == value
+        except ValueError:
+            return False
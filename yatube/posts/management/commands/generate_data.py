@@ -0,0 +1,52 @@
+import dataclasses
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware, utc
+
+from posts.seeding import SCALES, UNTIL, seed
+
+
+class Command(BaseCommand):
+    help = ('Наполняет базу синтетическими пользователями, группами, '
+            'подписками, постами и комментариями с правдоподобными '
+            'распределениями. Один и тот же --seed даёт один и тот же '
+            'набор данных.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='10k',
+                            help='Готовый набор размеров и параметров.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора случайных чисел.')
+        parser.add_argument('--until', default=UNTIL.isoformat(),
+                            help='Момент ISO 8601 (2024-01-01T00:00), до '
+                                 'которого раскиданы даты публикации; по '
+                                 'умолчанию постоянный, а не текущий.')
+        for field in dataclasses.fields(SCALES['10k']):
+            parser.add_argument(
+                f'--{field.name.replace("_", "-")}', type=field.type,
+                help=f'Переопределить {field.name} из --scale.',
+            )
+
+    def handle(self, *args, **options):
+        overrides = {field.name: options[field.name]
+                     for field in dataclasses.fields(SCALES['10k'])
+                     if options[field.name] is not None}
+        scale = dataclasses.replace(SCALES[options['scale']], **overrides)
+        if min(scale.users, scale.posts, scale.transaction_size) <= 0:
+            raise CommandError('Нужны хотя бы один пользователь и пост.')
+        until = parse_datetime(options['until'])
+        if until is None:
+            raise CommandError(f'Не удалось разобрать --until '
+                               f'{options["until"]!r}.')
+        if is_naive(until):
+            until = make_aware(until, utc)
+        start = time.perf_counter()
+        created = seed(scale, options['seed'], log=self.stdout.write,
+                       until=until)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f'{name}: {count}' for name, count in created.items())
+            + f'. Заняло {elapsed:.1f} с'
+        ))
@@ -0,0 +1,79 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.db.models.functions import Length
+
+from posts.models import Post
+from posts.thumbnails import create_executor, generate, save_variants
+
+PROGRESS_EVERY = 100
+
+
+class Command(BaseCommand):
+    help = ('Заранее нарезает миниатюры и адаптивные варианты всех '
+            'картинок постов. Готовые миниатюры sorl-thumbnail пропускает.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.POSTS_THUMBNAIL_WORKERS,
+            help='Число процессов; 0 — резать в текущем процессе.',
+        )
+
+    def handle(self, *args, **options):
+        # Варианты режутся заново, только если хоть у одного поста с этой
+        # картинкой их нет; иначе лишь досоздаются миниатюры.
+        names = (Post.objects
+                 .exclude(image='')
+                 .values('image')
+                 .annotate(ready=Min(Length('image_variants')))
+                 .order_by('image')
+                 .values_list('image', 'ready'))
+        total = names.count()
+        self.done = self.failed = 0
+        if options['workers'] > 0:
+            self.run_parallel(names.iterator(), options['workers'], total)
+        else:
+            for name, ready in names.iterator():
+                try:
+                    save_variants(name, generate(name, not ready))
+                except Exception as error:
+                    self.report_failure(name, error)
+                self.report_progress(total)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {self.done} из {total}, '
+            f'с ошибками: {self.failed}'
+        ))
+
+    def run_parallel(self, names, workers, total):
+        # Очередь ограничена, чтобы не держать в памяти задачи по всем
+        # картинкам сразу.
+        limit = workers * 4
+        pending = {}
+        with create_executor(workers) as executor:
+            for name, ready in names:
+                if len(pending) >= limit:
+                    self.collect(pending, total, FIRST_COMPLETED)
+                pending[executor.submit(generate, name, not ready)] = name
+            while pending:
+                self.collect(pending, total, FIRST_COMPLETED)
+
+    def collect(self, pending, total, return_when):
+        finished, _ = wait(pending, return_when=return_when)
+        for future in finished:
+            name = pending.pop(future)
+            if future.exception() is not None:
+                self.report_failure(name, future.exception())
+            else:
+                save_variants(name, future.result())
+            self.report_progress(total)
+
+    def report_failure(self, name, error):
+        self.failed += 1
+        self.stderr.write(f'{name}: {error}')
+
+    def report_progress(self, total):
+        self.done += 1
+        if self.done % PROGRESS_EVERY == 0:
+            self.stdout.write(f'{self.done} из {total}')
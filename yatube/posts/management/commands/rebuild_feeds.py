@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import feeds
+from posts.models import FeedEntry, Follow, User
+
+
+class Command(BaseCommand):
+    help = ('Сверяет материализованные ленты подписок с живой выборкой '
+            'через Follow и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='usernames', default=[],
+            help='Обработать только ленту указанного пользователя.',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только показать расхождения, ничего не меняя.',
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Удалить ленты целиком и собрать их заново.',
+        )
+
+    def handle(self, *args, **options):
+        if options['check'] and options['rebuild']:
+            raise CommandError('--check и --rebuild несовместимы.')
+        user_ids = self.get_user_ids(options['usernames'])
+        drifted = 0
+        for user_id in user_ids:
+            if options['check']:
+                added = feeds.missing_posts(user_id).count()
+                removed = feeds.stale_entries(user_id).count()
+            else:
+                with transaction.atomic():
+                    if options['rebuild']:
+                        FeedEntry.objects.filter(user_id=user_id).delete()
+                    added, removed = feeds.repair(user_id)
+            if added or removed:
+                drifted += 1
+                self.stdout.write(
+                    f'user={user_id}: не хватало {added}, лишних {removed}'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено лент: {len(user_ids)}, с расхождениями: {drifted}'
+        ))
+        if options['check'] and drifted:
+            raise CommandError('Ленты расходятся с таблицей подписок.')
+
+    def get_user_ids(self, usernames):
+        if usernames:
+            users = User.objects.filter(username__in=usernames)
+            user_ids = list(users.values_list('pk', flat=True))
+            if len(user_ids) != len(set(usernames)):
+                raise CommandError('Часть пользователей не найдена.')
+            return user_ids
+        followers = Follow.objects.values_list('user_id', flat=True)
+        readers = FeedEntry.objects.values_list('user_id', flat=True)
+        return sorted(set(followers.distinct()) | set(readers.distinct()))
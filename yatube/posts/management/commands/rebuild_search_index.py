@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from posts.search import fts_available, install_triggers
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс FTS5 постов и комментариев.'
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite.')
+        install_triggers()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_search')
+            cursor.execute(
+                'INSERT INTO posts_search(rowid, text, post_id) '
+                'SELECT id * 2, text, id FROM posts_post '
+                'UNION ALL '
+                'SELECT id * 2 + 1, text, post_id FROM posts_comment'
+            )
+            cursor.execute(
+                "INSERT INTO posts_search(posts_search) VALUES('optimize')"
+            )
+            cursor.execute('SELECT COUNT(*) FROM posts_search')
+            total = cursor.fetchone()[0]
+        self.stdout.write(self.style.SUCCESS(
+            f'В индексе записей: {total}'
+        ))
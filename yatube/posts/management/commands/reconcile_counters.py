@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from posts.models import Comment, Follow, Post, User, UserStats
+
+CHUNK_SIZE = 1000
+
+
+def count_by(queryset, field, ids):
+    return dict(queryset
+                .filter(**{f'{field}__in': ids})
+                .values_list(field)
+                .annotate(total=Count('pk'))
+                .order_by())
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счётчики по живым таблицам '
+            'и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не меняя.',
+        )
+
+    def handle(self, *args, **options):
+        fixed = self.reconcile_user_stats(options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено записей статистики пользователей: {fixed}'
+        ))
+        fixed = self.reconcile_comments_count(options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков комментариев постов: {fixed}'
+        ))
+
+    def reconcile_user_stats(self, dry_run):
+        fixed = 0
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True)
+        ids = list(user_ids[:CHUNK_SIZE])
+        while ids:
+            posts = count_by(Post.objects, 'author_id', ids)
+            followers = count_by(Follow.objects, 'author_id', ids)
+            following = count_by(Follow.objects, 'user_id', ids)
+            stats = UserStats.objects.in_bulk(ids)
+            for user_id in ids:
+                expected = {
+                    'posts_count': posts.get(user_id, 0),
+                    'followers_count': followers.get(user_id, 0),
+                    'following_count': following.get(user_id, 0),
+                }
+                current = stats.get(user_id)
+                if current and all(getattr(current, field) == value
+                                   for field, value in expected.items()):
+                    continue
+                fixed += 1
+                self.stdout.write(f'user={user_id}: {expected}')
+                if not dry_run:
+                    with transaction.atomic():
+                        UserStats.objects.update_or_create(
+                            user_id=user_id, defaults=expected
+                        )
+            ids = list(user_ids.filter(pk__gt=ids[-1])[:CHUNK_SIZE])
+        return fixed
+
+    def reconcile_comments_count(self, dry_run):
+        fixed = 0
+        posts = Post.objects.order_by('pk').values_list('pk',
+                                                        'comments_count')
+        chunk = list(posts[:CHUNK_SIZE])
+        while chunk:
+            ids = [post_id for post_id, _ in chunk]
+            comments = count_by(Comment.objects, 'post_id', ids)
+            for post_id, comments_count in chunk:
+                expected = comments.get(post_id, 0)
+                if comments_count == expected:
+                    continue
+                fixed += 1
+                self.stdout.write(f'post={post_id}: {expected}')
+                if not dry_run:
+                    Post.objects.filter(pk=post_id).update(
+                        comments_count=expected
+                    )
+            chunk = list(posts.filter(pk__gt=ids[-1])[:CHUNK_SIZE])
+        return fixed
@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Now
+
+from core.storage import file_digest, is_sharded
+from posts import images, thumbnails
+from posts.models import Post
+from posts.signals import invalidate_post
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов из плоского каталога в подкаталоги '
+            'по хэшу содержимого и обновляет ссылки на них.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Сколько файлов переносить за транзакцию.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Сколько потоков хэшируют и копируют файлы.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать файлы для переноса.')
+
+    def handle(self, *args, **options):
+        self.storage = Post._meta.get_field('image').storage
+        names = (Post.objects
+                 .exclude(image='')
+                 .order_by('image')
+                 .values_list('image', flat=True)
+                 .distinct())
+        moved = missing = 0
+        chunk = list(names[:options['batch_size']])
+        with ThreadPoolExecutor(options['workers']) as pool:
+            while chunk:
+                legacy = [name for name in chunk if not is_sharded(name)]
+                if options['dry_run']:
+                    moved += len(legacy)
+                else:
+                    placed = []
+                    for old, new in pool.map(self.place, legacy):
+                        if new is None:
+                            missing += 1
+                            self.stderr.write(f'Нет файла: {old}')
+                        else:
+                            placed.append((old, new))
+                    self.switch(placed)
+                    moved += len(placed)
+                    self.stdout.write(f'Перенесено: {moved}')
+                chunk = list(names.filter(image__gt=chunk[-1])
+                             [:options['batch_size']])
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Нужно перенести" if options["dry_run"] else "Перенесено"} '
+            f'файлов: {moved}, не найдено: {missing}'
+        ))
+
+    def place(self, old):
+        """Кладёт копию файла по новому имени; старый пока остаётся."""
+        path = self.storage.path(old)
+        if not os.path.exists(path):
+            return old, None
+        directory = os.path.dirname(old)
+        extension = os.path.splitext(old)[1].lower()
+        new = self.storage.hashed_name(directory, file_digest(path),
+                                       extension)
+        self.link(path, self.storage.path(new))
+        return old, new
+
+    @staticmethod
+    def link(path, new_path):
+        """Жёсткая ссылка на файл, а если нельзя — копия."""
+        if not os.path.exists(new_path):
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            try:
+                os.link(path, new_path)
+            except OSError:
+                shutil.copy2(path, new_path)
+
+    def switch(self, placed):
+        """Переводит посты на новые имена и убирает старые файлы.
+
+        Имена вариантов строятся от имени картинки, поэтому варианты
+        переезжают вместе с ней, в той же транзакции: иначе описание
+        ссылалось бы на основу, которой нет ни у одной картинки, и
+        collect_media удалил бы показываемые файлы.
+        """
+        if not placed:
+            return
+        moved_variants = []
+        with transaction.atomic():
+            for old, new in placed:
+                posts = Post.objects.filter(image=old)
+                for raw in (posts.order_by()
+                            .values_list('image_variants', flat=True)
+                            .distinct()):
+                    renamed, stale = self.place_variants(raw, new)
+                    posts.filter(image_variants=raw).update(
+                        image=new, image_variants=renamed, updated=Now())
+                    moved_variants.extend(stale)
+        # Старые файлы удаляются только после фиксации: до неё посты
+        # ссылаются на них.
+        for old, new in placed:
+            thumbnails.invalidate(old)
+            self.storage.delete(old)
+        for name in moved_variants:
+            default_storage.delete(name)
+        posts = Post.objects.filter(image__in=[new for _, new in placed])
+        for post in posts.only('pk', 'author_id', 'group_id'):
+            invalidate_post(post)
+
+    def place_variants(self, raw, new):
+        """Кладёт копии вариантов под имена от новой картинки.
+
+        Возвращает новое описание и старые имена, которые больше не
+        нужны. Вариант без файла остаётся в описании как был.
+        """
+        if not raw:
+            return raw, []
+        variants = json.loads(raw)
+        stale = []
+        for entries in variants.values():
+            for entry in entries:
+                old = entry['name']
+                extension = os.path.splitext(old)[1][1:]
+                target = images.variant_name(new, entry['width'],
+                                             extension)
+                if target == old:
+                    continue
+                path = default_storage.path(old)
+                if not os.path.exists(path):
+                    continue
+                self.link(path, default_storage.path(target))
+                entry['name'] = target
+                stale.append(old)
+        return json.dumps(variants), stale
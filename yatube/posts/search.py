@@ -0,0 +1,178 @@
+import re
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+
+SNIPPET_TOKENS = 12
+# Маркеры подсветки не встречаются в тексте постов: snippet() возвращает
+# сырой текст, экранируем его сами и только потом ставим <mark>.
+MARK_START, MARK_END = '\x02', '\x03'
+ELLIPSIS = '…'
+
+SearchHit = namedtuple('SearchHit', ('post', 'snippet', 'in_comment'))
+
+# Посты лежат в индексе под rowid = 2 * id, комментарии — под 2 * id + 1.
+# SQLite пересоздаёт таблицу при изменении схемы и теряет её триггеры,
+# поэтому они ставятся заново после каждой миграции.
+TRIGGERS_SQL = (
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_search_post_insert
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO posts_search(rowid, text, post_id)
+        VALUES (new.id * 2, new.text, new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_search_post_update
+    AFTER UPDATE OF text ON posts_post BEGIN
+        DELETE FROM posts_search WHERE rowid = old.id * 2;
+        INSERT INTO posts_search(rowid, text, post_id)
+        VALUES (new.id * 2, new.text, new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_search_post_delete
+    AFTER DELETE ON posts_post BEGIN
+        DELETE FROM posts_search WHERE rowid = old.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_search_comment_insert
+    AFTER INSERT ON posts_comment BEGIN
+        INSERT INTO posts_search(rowid, text, post_id)
+        VALUES (new.id * 2 + 1, new.text, new.post_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_search_comment_update
+    AFTER UPDATE OF text, post_id ON posts_comment BEGIN
+        DELETE FROM posts_search WHERE rowid = old.id * 2 + 1;
+        INSERT INTO posts_search(rowid, text, post_id)
+        VALUES (new.id * 2 + 1, new.text, new.post_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_search_comment_delete
+    AFTER DELETE ON posts_comment BEGIN
+        DELETE FROM posts_search WHERE rowid = old.id * 2 + 1;
+    END
+    """,
+)
+
+
+def fts_available(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def install_triggers(using=connection):
+    """Ставит недостающие триггеры синхронизации индекса."""
+    if not fts_available(using):
+        return
+    with using.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s",
+                       ['posts_search'])
+        if cursor.fetchone() is None:
+            return
+        for statement in TRIGGERS_SQL:
+            cursor.execute(statement)
+
+
+def match_expression(query):
+    """Переводит ввод пользователя в безопасное выражение FTS5.
+
+    Каждое слово становится фразой с поиском по префиксу, так что
+    операторы и кавычки из запроса не ломают синтаксис MATCH.
+    """
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def highlight(snippet):
+    return mark_safe(escape(snippet)
+                     .replace(MARK_START, '<mark>')
+                     .replace(MARK_END, '</mark>'))
+
+
+class SearchResults:
+    """Ранжированная выдача FTS5, которую можно отдать в Paginator."""
+
+    def __init__(self, query):
+        self.match = match_expression(query)
+
+    def count(self):
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT COUNT(*) FROM posts_search '
+                'WHERE posts_search MATCH %s',
+                [self.match],
+            )
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        if not self.match or index.stop is None or index.stop <= start:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid, post_id, '
+                'snippet(posts_search, 0, %s, %s, %s, %s) '
+                'FROM posts_search WHERE posts_search MATCH %s '
+                'ORDER BY rank LIMIT %s OFFSET %s',
+                [MARK_START, MARK_END, ELLIPSIS, SNIPPET_TOKENS,
+                 self.match, index.stop - start, start],
+            )
+            rows = cursor.fetchall()
+        posts = (Post.objects
+                 .select_related('author', 'group')
+                 .in_bulk({post_id for _, post_id, _ in rows}))
+        return [SearchHit(posts[post_id], highlight(snippet), rowid % 2 == 1)
+                for rowid, post_id, snippet in rows if post_id in posts]
+
+
+class LikeSearchResults(SearchResults):
+    """Запасной путь через LIKE для баз без FTS5."""
+
+    def __init__(self, query):
+        self.query = query.strip()
+        self.posts = (Post.objects
+                      .select_related('author', 'group')
+                      .filter(text__icontains=self.query))
+
+    def count(self):
+        return self.posts.count() if self.query else 0
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if not self.query:
+            return []
+        return [SearchHit(post, post.text[:200], False)
+                for post in self.posts[index]]
+
+
+def search(query):
+    if fts_available():
+        return SearchResults(query)
+    return LikeSearchResults(query)
+
+
+def matching_ids(query, comments=False):
+    """Подзапрос id постов или комментариев, подходящих под запрос."""
+    parity = 1 if comments else 0
+    return RawSQL(
+        'SELECT rowid / 2 FROM posts_search '
+        'WHERE posts_search MATCH %s AND rowid %% 2 = %s',
+        [match_expression(query), parity],
+    )
@@ -0,0 +1,298 @@
+"""Быстрое наполнение базы синтетическими данными.
+
+Объекты идут потоком пачками через bulk_create с заранее выбранными
+первичными ключами и фиксируются крупными транзакциями, так что в
+памяти никогда не лежит весь набор. Сигналы при этом не срабатывают,
+поэтому производные таблицы (ленты подписок, статистика пользователей,
+счётчики комментариев) заполняются в конце запросами INSERT … SELECT и
+UPDATE по всему набору. Один и тот же seed даёт один и тот же набор:
+даты отсчитываются не от текущего момента, а от момента until.
+
+Распределения похожи на живой сайт:
+
+* авторы постов выбираются по закону Ципфа: немногие пишут больше всех;
+* подписки тоже по Ципфу, но по своим рангам, так что и число
+  подписчиков, и число подписок у пользователей с тяжёлым хвостом;
+* комментарии достаются постам по Ципфу;
+* время публикации — фон, равномерный по периоду, плюс всплески, в
+  которые посты идут плотной пачкой.
+"""
+import random
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import accumulate, chain, islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils.timezone import utc
+
+from .models import Comment, FeedEntry, Follow, Group, Post, User, UserStats
+from .utils import batches
+
+BATCH_SIZE = 5000
+# Момент, к которому по умолчанию приурочены даты набора.
+UNTIL = datetime(2024, 1, 1, tzinfo=utc)
+PASSWORD = 'benchmark'
+WORDS = ('пост', 'лента', 'группа', 'автор', 'новость', 'картинка',
+         'подписка', 'комментарий', 'сегодня', 'вечер', 'город', 'кофе',
+         'работа', 'книга', 'кино', 'поезд', 'море', 'горы', 'музыка')
+
+
+@dataclass(frozen=True)
+class Scale:
+    """Размер набора и параметры распределений."""
+
+    users: int
+    groups: int
+    posts: int
+    comments: int
+    follows: int
+    # За сколько дней до момента until раскиданы посты.
+    days: int = 365
+    # Показатели закона Ципфа: чем больше, тем сильнее перекос.
+    author_exponent: float = 1.1
+    follow_exponent: float = 1.1
+    comment_exponent: float = 1.1
+    # Доля постов во всплесках, число всплесков и их характерная длина.
+    burst_share: float = 0.3
+    bursts: int = 50
+    burst_hours: float = 2
+    # Сколько строк фиксировать одной транзакцией.
+    transaction_size: int = 100_000
+
+
+SCALES = {
+    'smoke': Scale(users=50, groups=5, posts=300, comments=600,
+                   follows=300, bursts=5),
+    '10k': Scale(users=1_000, groups=20, posts=10_000, comments=20_000,
+                 follows=10_000),
+    '1m': Scale(users=50_000, groups=200, posts=1_000_000,
+                comments=2_000_000, follows=500_000, bursts=500),
+}
+
+
+def zipf_weights(count, exponent):
+    """Накопленные веса рангов 1..count по закону Ципфа."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, count + 1)))
+
+
+def next_pk(model):
+    last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+    return (last or 0) + 1
+
+
+@contextmanager
+def raw_timestamps(*fields):
+    """Даёт записать pub_date и updated как есть, без auto_now."""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field, _, _ in saved:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+class Ranking:
+    """Идентификаторы в случайном порядке с весами рангов по Ципфу."""
+
+    def __init__(self, rng, ids, exponent):
+        self.rng = rng
+        self.ids = rng.sample(ids, len(ids))
+        self.weights = zipf_weights(len(ids), exponent)
+
+    def pick(self, count):
+        return self.rng.choices(self.ids, cum_weights=self.weights, k=count)
+
+
+class Seeder:
+    """Наполняет базу набором данных масштаба scale."""
+
+    def __init__(self, scale, seed=0, log=None, until=UNTIL):
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.now = until
+        self.log = log or (lambda message: None)
+
+    def run(self):
+        self.first_user_id = next_pk(User)
+        self.first_post_id = next_pk(Post)
+        user_ids = self.create_users()
+        group_ids = self.create_groups()
+        self.create_follows(user_ids)
+        self.create_posts(user_ids, group_ids)
+        self.create_comments(user_ids)
+        self.fill_derived()
+        return self.summary()
+
+    def create_users(self):
+        start = self.first_user_id
+        user_ids = range(start, start + self.scale.users)
+        password = make_password(PASSWORD)
+        self.bulk_create(User, (
+            User(pk=pk, username=f'user{pk}', password=password)
+            for pk in user_ids
+        ))
+        return list(user_ids)
+
+    def create_groups(self):
+        start = next_pk(Group)
+        group_ids = range(start, start + self.scale.groups)
+        self.bulk_create(Group, (
+            Group(pk=pk, slug=f'group-{pk}', title=f'Группа {pk}',
+                  description=self.text(8))
+            for pk in group_ids
+        ))
+        return list(group_ids)
+
+    def create_follows(self, user_ids):
+        """Подписки: кто подписывается и на кого — по своим рангам Ципфа.
+
+        Повторы и подписки на себя отбрасываются, так что подписок может
+        выйти меньше заказанного.
+        """
+        readers = Ranking(self.rng, user_ids, self.scale.follow_exponent)
+        authors = Ranking(self.rng, user_ids, self.scale.follow_exponent)
+        pairs = set()
+        for start in range(0, self.scale.follows, BATCH_SIZE):
+            count = min(BATCH_SIZE, self.scale.follows - start)
+            pairs.update(pair
+                         for pair in zip(readers.pick(count),
+                                         authors.pick(count))
+                         if pair[0] != pair[1])
+        self.follows = len(pairs)
+        self.bulk_create(Follow, (
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id, author_id in sorted(pairs)
+        ))
+
+    def create_posts(self, user_ids, group_ids):
+        writers = Ranking(self.rng, user_ids, self.scale.author_exponent)
+        dates = self.publication_dates()
+
+        def posts():
+            pk = self.first_post_id
+            for start in range(0, self.scale.posts, BATCH_SIZE):
+                count = min(BATCH_SIZE, self.scale.posts - start)
+                for author_id in writers.pick(count):
+                    pub_date = next(dates)
+                    yield Post(
+                        pk=pk, author_id=author_id, text=self.text(20),
+                        group_id=(self.rng.choice(group_ids)
+                                  if group_ids and self.rng.random() < 0.5
+                                  else None),
+                        pub_date=pub_date, updated=pub_date,
+                    )
+                    pk += 1
+
+        with raw_timestamps(Post._meta.get_field('pub_date'),
+                            Post._meta.get_field('updated')):
+            self.bulk_create(Post, posts())
+
+    def create_comments(self, user_ids):
+        if not self.scale.posts:
+            return
+        posts = Ranking(self.rng,
+                        range(self.first_post_id,
+                              self.first_post_id + self.scale.posts),
+                        self.scale.comment_exponent)
+
+        def comments():
+            for start in range(0, self.scale.comments, BATCH_SIZE):
+                count = min(BATCH_SIZE, self.scale.comments - start)
+                for post_id in posts.pick(count):
+                    yield Comment(post_id=post_id,
+                                  author_id=self.rng.choice(user_ids),
+                                  text=self.text(8),
+                                  pub_date=self.random_date())
+
+        with raw_timestamps(Comment._meta.get_field('pub_date')):
+            self.bulk_create(Comment, comments())
+
+    def publication_dates(self):
+        """Бесконечный поток дат: фон и всплески в заданной пропорции."""
+        span = timedelta(days=self.scale.days).total_seconds()
+        centres = [self.rng.random() * span
+                   for _ in range(max(self.scale.bursts, 1))]
+        burst = self.scale.burst_hours * 60 * 60
+        while True:
+            if self.rng.random() < self.scale.burst_share:
+                offset = (self.rng.choice(centres)
+                          + self.rng.expovariate(1 / burst))
+                yield self.now - timedelta(seconds=min(offset, span))
+            else:
+                yield self.random_date()
+
+    def random_date(self):
+        span = timedelta(days=self.scale.days).total_seconds()
+        return self.now - timedelta(seconds=self.rng.random() * span)
+
+    def text(self, words):
+        return ' '.join(self.rng.choices(WORDS, k=words)).capitalize()
+
+    def fill_derived(self):
+        """Ленты, счётчики комментариев и статистика запросами по набору."""
+        self.log('Ленты подписок, счётчики и статистика…')
+        post = table(Post)
+        follow = table(Follow)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table(FeedEntry)} (user_id, post_id, pub_date) '
+                f'SELECT f.user_id, p.id, p.pub_date FROM {follow} f '
+                f'JOIN {post} p ON p.author_id = f.author_id '
+                f'WHERE p.id >= %s',
+                [self.first_post_id],
+            )
+            cursor.execute(
+                f'UPDATE {post} SET comments_count = ('
+                f'SELECT COUNT(*) FROM {table(Comment)} c '
+                f'WHERE c.post_id = {post}.id) '
+                f'WHERE id >= %s',
+                [self.first_post_id],
+            )
+            cursor.execute(
+                f'INSERT INTO {table(UserStats)} (user_id, posts_count, '
+                f'followers_count, following_count) '
+                f'SELECT u.id, '
+                f'(SELECT COUNT(*) FROM {post} p WHERE p.author_id = u.id), '
+                f'(SELECT COUNT(*) FROM {follow} f WHERE f.author_id = u.id), '
+                f'(SELECT COUNT(*) FROM {follow} f WHERE f.user_id = u.id) '
+                f'FROM {table(User)} u WHERE u.id >= %s',
+                [self.first_user_id],
+            )
+
+    def bulk_create(self, model, objects):
+        """Пишет поток объектов пачками, по transaction_size за транзакцию."""
+        stream = batches(objects, BATCH_SIZE)
+        per_transaction = max(self.scale.transaction_size // BATCH_SIZE, 1)
+        written = 0
+        for first in stream:
+            with transaction.atomic():
+                for batch in chain([first],
+                                   islice(stream, per_transaction - 1)):
+                    model.objects.bulk_create(batch)
+                    written += len(batch)
+            self.log(f'{model._meta.verbose_name_plural}: {written}')
+
+    def summary(self):
+        return {
+            'users': self.scale.users,
+            'groups': self.scale.groups,
+            'posts': self.scale.posts,
+            'comments': self.scale.comments,
+            'follows': self.follows,
+            'feed_entries': FeedEntry.objects.filter(
+                post_id__gte=self.first_post_id).count(),
+        }
+
+
+def seed(scale, seed=0, log=None, until=UNTIL):
+    """Наполняет базу и возвращает, сколько чего создано."""
+    return Seeder(scale, seed, log, until).run()
@@ -0,0 +1,193 @@
+import threading
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import counters, feeds, images, thumbnails, versions
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .utils import batches
+
+# Посты, которые сейчас удаляются: их комментарии уходят каскадом, и
+# сбрасывать кэш за каждый не нужно — это сделает post_deleted.
+_deleting = threading.local()
+
+
+def deleting_posts():
+    if not hasattr(_deleting, 'ids'):
+        _deleting.ids = set()
+    return _deleting.ids
+
+
+def invalidate_post(post, followers=True):
+    """Сбрасывает кэш всех лент, в которых виден пост.
+
+    followers=False пропускает ленты подписчиков, когда их уже сбросил
+    feeds.fan_out.
+    """
+    old_group_id = getattr(post, 'loaded_group_id', None)
+    versions.bump(
+        versions.global_key(),
+        versions.author_key(post.author_id),
+        versions.post_key(post.pk),
+        post.group_id and versions.group_key(post.group_id),
+        old_group_id and versions.group_key(old_group_id),
+    )
+    if not followers:
+        return
+    user_ids = (Follow.objects
+                .filter(author_id=post.author_id)
+                .values_list('user_id', flat=True)
+                .iterator())
+    for batch in batches(user_ids, settings.FEED_BATCH_SIZE):
+        versions.bump(*(versions.feed_key(user_id) for user_id in batch))
+
+
+def invalidate_posts(posts):
+    """Сбрасывает кэш всех страниц, где видны посты выборки posts."""
+    rows = posts.values_list('pk', 'author_id', 'group_id').iterator()
+    for batch in batches(rows, settings.FEED_BATCH_SIZE):
+        keys = []
+        for post_id, author_id, group_id in batch:
+            keys += [versions.post_key(post_id),
+                     versions.author_key(author_id),
+                     group_id and versions.group_key(group_id)]
+        versions.bump(*keys)
+    user_ids = (Follow.objects
+                .filter(author_id__in=posts.values('author_id'))
+                .values_list('user_id', flat=True)
+                .distinct()
+                .iterator())
+    for batch in batches(user_ids, settings.FEED_BATCH_SIZE):
+        versions.bump(*(versions.feed_key(user_id) for user_id in batch))
+    versions.bump(versions.global_key())
+
+
+# Поля, которые видны на карточках постов и страницах лент.
+SHOWN_FIELDS = {
+    Group: ('title', 'slug'),
+    User: ('username', 'first_name', 'last_name'),
+}
+
+
+@receiver(pre_save, sender=Group)
+@receiver(pre_save, sender=User)
+def shown_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Запоминает, поменялось ли то, что видно на страницах постов."""
+    instance.shown_changed = False
+    fields = SHOWN_FIELDS[sender]
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(fields) & set(update_fields):
+        return
+    saved = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    instance.shown_changed = saved is not None and any(
+        saved[field] != getattr(instance, field) for field in fields)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+    elif getattr(instance, 'shown_changed', False):
+        # Имя видно на постах автора и под его комментариями.
+        versions.bump(versions.author_key(instance.pk))
+        invalidate_posts(Post.objects.filter(
+            Q(author=instance) | Q(comments__author=instance)).distinct())
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    versions.bump(versions.global_key(), versions.group_key(instance.pk))
+    if getattr(instance, 'shown_changed', False):
+        invalidate_posts(instance.posts.all())
+
+
+def image_replaced(post):
+    loaded_image = getattr(post, 'loaded_image', None)
+    return bool(loaded_image) and loaded_image != post.image.name
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if image_replaced(instance):
+        instance.stale_variants = instance.image_variants
+        instance.image_variants = ''
+    # Новая загрузка ещё не записана в хранилище: читаем её, пока
+    # файл под рукой, чтобы при показе не открывать его снова.
+    if not instance.image or not instance.image._committed:
+        images.fill_metadata(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        feeds.fan_out(instance)
+        counters.increment(instance.author_id, posts_count=1)
+    if image_replaced(instance):
+        thumbnails.release(instance.loaded_image,
+                           getattr(instance, 'stale_variants', ''))
+    instance.loaded_image = instance.image.name
+    invalidate_post(instance, followers=not created)
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    deleting_posts().add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    deleting_posts().discard(instance.pk)
+    counters.decrement(instance.author_id, posts_count=1)
+    thumbnails.release(instance.image.name, instance.image_variants)
+    invalidate_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feeds.backfill(instance.user_id, instance.author_id)
+        counters.increment(instance.author_id, followers_count=1)
+        counters.increment(instance.user_id, following_count=1)
+        versions.bump(versions.feed_key(instance.user_id),
+                      versions.author_key(instance.author_id),
+                      versions.author_key(instance.user_id))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    feeds.prune(instance.user_id, instance.author_id)
+    counters.decrement(instance.author_id, followers_count=1)
+    counters.decrement(instance.user_id, following_count=1)
+    versions.bump(versions.feed_key(instance.user_id),
+                  versions.author_key(instance.author_id),
+                  versions.author_key(instance.user_id))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.increment_comments(instance.post_id)
+        invalidate_post(instance.post)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id in deleting_posts():
+        return
+    counters.decrement_comments(instance.post_id)
+    try:
+        invalidate_post(instance.post)
+    except Post.DoesNotExist:
+        pass
@@ -0,0 +1,53 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts import thumbnails
+
+register = template.Library()
+
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+
+
+def card_key(post, group_flag, profile_flag):
+    """Ключ карточки: меняется вместе с постом и тем, что в ней видно."""
+    shown = '|'.join((
+        post.author.username,
+        post.author.get_full_name(),
+        post.group.slug if post.group else '',
+        post.group.title if post.group else '',
+    ))
+    digest = hashlib.md5(shown.encode()).hexdigest()
+    return (f'post_card:{post.pk}:{post.updated.timestamp()}:'
+            f'{post.comments_count}:{digest}:'
+            f'{int(group_flag)}{int(profile_flag)}')
+
+
+@register.simple_tag
+def post_cards(posts, group_flag=False, profile_flag=False):
+    """HTML карточек постов страницы, по возможности из кэша.
+
+    Все карточки достаются одним get_many, рендерятся только промахи;
+    метаданные их миниатюр загружаются заранее одной пачкой.
+    """
+    posts = list(posts)
+    keys = [card_key(post, group_flag, profile_flag) for post in posts]
+    cards = cache.get_many(keys)
+    missing = {}
+    thumbnails.prefetch(post for post, key in zip(posts, keys)
+                        if key not in cards)
+    for post, key in zip(posts, keys):
+        if key not in cards:
+            missing[key] = render_to_string(CARD_TEMPLATE, {
+                'post': post,
+                'group_flag': group_flag,
+                'profile_flag': profile_flag,
+            })
+    if missing:
+        cache.set_many(missing, timeout=settings.POSTS_CACHE_TIMEOUT)
+        cards.update(missing)
+    return [mark_safe(cards[key]) for key in keys]
@@ -0,0 +1,22 @@
+from django import template
+from django.conf import settings
+
+from posts.images import picture_sources
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/post_image.html')
+def post_image(post, sizes=None, lazy=True):
+    """Картинка поста через <picture> с srcset по готовым вариантам.
+
+    Пока вариантов нет, выводится обычная миниатюра sorl-thumbnail.
+    Размеры и заглушка берутся из поста, файл при рендере не читается.
+    """
+    return {
+        'image': post.image,
+        'placeholder': post.image_placeholder,
+        'lazy': lazy,
+        'picture': picture_sources(post),
+        'sizes': sizes or settings.POSTS_IMAGE_SIZES,
+    }
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Max, Min
+from django.test import TestCase
+from django.utils.timezone import utc
+
+from posts import benchmark
+from posts.models import Comment, Group, Post, User
+from posts.seeding import SCALES, seed
+
+
+class SeedingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.dataset = seed(SCALES['smoke'], seed=1)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_dataset_consistent(self):
+        """Проверяет что засеянные данные согласованы с производными"""
+        scale = SCALES['smoke']
+        self.assertEqual(User.objects.count(), scale.users)
+        self.assertEqual(Post.objects.count(), scale.posts)
+        self.assertEqual(Comment.objects.count(), scale.comments)
+        call_command('rebuild_feeds', '--check', stdout=StringIO())
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('пользователей: 0', out.getvalue())
+        self.assertIn('постов: 0', out.getvalue())
+
+    def test_views_measured(self):
+        """Проверяет что замер выдаёт сводку по каждому представлению"""
+        report = benchmark.run(3, seed=1)
+        self.assertEqual(set(report), set(benchmark.SCENARIOS))
+        for summary in report.values():
+            self.assertLessEqual(summary['p50_ms'], summary['p95_ms'])
+            self.assertGreater(summary['queries_max'], 0)
+
+
+class GenerateDataCommandTest(TestCase):
+    def snapshot(self):
+        return list(Post.objects.order_by('pk').values_list(
+            'pk', 'author_id', 'group_id', 'text', 'comments_count',
+            'pub_date'))
+
+    def test_same_seed_same_data(self):
+        """Проверяет что одно зерно даёт одинаковые данные"""
+        options = ['--scale', 'smoke', '--seed', '7', '--posts', '120',
+                   '--transaction-size', '50']
+        call_command('generate_data', *options, stdout=StringIO())
+        first = self.snapshot()
+        self.assertEqual(len(first), 120)
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        call_command('generate_data', *options, stdout=StringIO())
+        self.assertEqual(self.snapshot(), first)
+
+    def test_dates_end_at_until(self):
+        """Проверяет что даты публикации раскиданы до момента --until"""
+        call_command('generate_data', '--scale', 'smoke', '--days', '10',
+                     '--until', '2025-06-01T00:00', stdout=StringIO())
+        dates = Post.objects.aggregate(first=Min('pub_date'),
+                                       last=Max('pub_date'))
+        until = datetime(2025, 6, 1, tzinfo=utc)
+        self.assertLessEqual(dates['last'], until)
+        self.assertGreaterEqual(dates['first'], until - timedelta(days=10))
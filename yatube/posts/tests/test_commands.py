@@ -0,0 +1,307 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from sorl.thumbnail import default
+
+from posts import images, thumbnails, uploads
+from posts.management.commands.collect_media import Command as CollectMedia
+from posts.models import (ChunkedUpload, Comment, FeedEntry, Follow, Post,
+                          User, UserStats)
+from posts.search import SearchResults
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+small_gif = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+class RebuildFeedsCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        cls.post = Post.objects.create(author=cls.author, text='Пост в ленту')
+
+    def test_feed_filled_on_post_and_follow(self):
+        """Проверяет что посты раскладываются по лентам подписчиков"""
+        self.assertTrue(FeedEntry.objects.filter(user=self.user,
+                                                 post=self.post).exists())
+        Follow.objects.all().delete()
+        self.assertFalse(FeedEntry.objects.exists())
+
+    def test_check_reports_drift(self):
+        """Проверяет что --check находит расхождение с подписками"""
+        call_command('rebuild_feeds', '--check', stdout=StringIO())
+        FeedEntry.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_feeds', '--check', stdout=StringIO())
+
+    def test_repair_restores_feed(self):
+        """Проверяет что команда восстанавливает ленту"""
+        FeedEntry.objects.all().delete()
+        FeedEntry.objects.create(user=self.author, post=self.post,
+                                 pub_date=self.post.pub_date)
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(
+            list(FeedEntry.objects.values_list('user', 'post')),
+            [(self.user.pk, self.post.pk)]
+        )
+
+
+class ReconcileCountersCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        Post.objects.create(author=cls.author, text='Первый пост')
+        Post.objects.create(author=cls.author, text='Второй пост')
+
+    def test_signals_keep_stats(self):
+        """Проверяет что сигналы поддерживают счётчики пользователей"""
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual((stats.posts_count, stats.followers_count,
+                          stats.following_count), (2, 1, 0))
+        Follow.objects.all().delete()
+        Post.objects.first().delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.posts_count, stats.followers_count), (1, 0))
+        self.assertEqual(UserStats.objects.get(user=self.user)
+                         .following_count, 0)
+
+    def test_reconcile_fixes_drift(self):
+        """Проверяет что команда исправляет разошедшиеся счётчики"""
+        UserStats.objects.filter(user=self.author).update(posts_count=40)
+        UserStats.objects.filter(user=self.user).delete()
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 2)
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).following_count, 1)
+
+    def test_reconcile_fixes_comments_count(self):
+        """Проверяет что команда пересчитывает комментарии постов"""
+        post = Post.objects.first()
+        Comment.objects.create(post=post, author=self.user, text='Коммент')
+        Post.objects.update(comments_count=7)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(
+            dict(Post.objects.values_list('pk', 'comments_count')),
+            {pk: int(pk == post.pk)
+             for pk in Post.objects.values_list('pk', flat=True)}
+        )
+
+
+class RebuildSearchIndexCommandTest(TestCase):
+    def test_rebuild_restores_index(self):
+        """Проверяет что команда заново наполняет поисковый индекс"""
+        author = User.objects.create_user(username='writer')
+        post = Post.objects.create(author=author, text='Уникальное слово')
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_search')
+        self.assertEqual(SearchResults('уникальное').count(), 0)
+        call_command('rebuild_search_index', stdout=StringIO())
+        hits = SearchResults('уникальное')[:10]
+        self.assertEqual([hit.post for hit in hits], [post])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class GenerateThumbnailsCommandTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_generates_missing_thumbnails(self):
+        """Проверяет что команда нарезает миниатюры картинок постов"""
+        author = User.objects.create_user(username='writer')
+        Post.objects.create(
+            author=author, text='Пост с картинкой',
+            image=SimpleUploadedFile('small.gif', small_gif,
+                                     content_type='image/gif'),
+        )
+        out = StringIO()
+        call_command('generate_thumbnails', '--workers', '0', stdout=out)
+        self.assertIn('Обработано картинок: 1 из 1', out.getvalue())
+        thumbnails = [name
+                      for _, _, names in os.walk(
+                          os.path.join(TEMP_MEDIA_ROOT, 'cache'))
+                      for name in names]
+        self.assertEqual(len(thumbnails),
+                         len(settings.POSTS_THUMBNAIL_GEOMETRIES))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ShardMediaCommandTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_flat_files_moved_to_shards(self):
+        """Проверяет что старые картинки переезжают в подкаталоги"""
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'posts'), exist_ok=True)
+        with open(os.path.join(TEMP_MEDIA_ROOT, 'posts', 'old.gif'),
+                  'wb') as file:
+            file.write(small_gif)
+        author = User.objects.create_user(username='writer')
+        post = Post.objects.create(author=author, text='Старый пост',
+                                   image='posts/old.gif')
+        call_command('shard_media', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertRegex(post.image.name,
+                         r'^posts/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]+'
+                         r'\.gif$')
+        with post.image.open() as image:
+            self.assertEqual(image.read(), small_gif)
+        self.assertFalse(os.path.exists(
+            os.path.join(TEMP_MEDIA_ROOT, 'posts', 'old.gif')))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CollectMediaCommandTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def tearDown(self):
+        # Записи sorl-thumbnail в кэше переживают откат транзакции теста.
+        cache.clear()
+        default.kvstore.lru.clear()
+
+    def write(self, name, content=small_gif):
+        path = os.path.join(TEMP_MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def files(self):
+        return {os.path.relpath(os.path.join(directory, name),
+                                TEMP_MEDIA_ROOT)
+                for directory, _, names in os.walk(TEMP_MEDIA_ROOT)
+                for name in names}
+
+    def test_orphans_removed(self):
+        """Проверяет что удаляются только файлы без ссылок"""
+        author = User.objects.create_user(username='writer')
+        post = Post.objects.create(
+            author=author, text='Пост с картинкой',
+            image=SimpleUploadedFile('small.gif', small_gif,
+                                     content_type='image/gif'),
+        )
+        variant = 'posts/variants/00/00/' + (
+            os.path.splitext(os.path.basename(post.image.name))[0]
+            + '-480.jpg')
+        self.write(variant)
+        Post.objects.filter(pk=post.pk).update(image_variants=json.dumps(
+            {'jpeg': [{'name': variant, 'width': 480, 'height': 170}]}))
+        thumbnails.generate(post.image.name, with_variants=False)
+        self.write('posts/gone.gif')
+        before = self.files()
+        thumbnails.generate('posts/gone.gif', with_variants=False)
+        stale = self.files() - before
+        upload = ChunkedUpload.objects.create(user=author, filename='a.gif',
+                                              size=10)
+        self.write(os.path.relpath(uploads.part_path(upload),
+                                   TEMP_MEDIA_ROOT))
+        ChunkedUpload.objects.filter(pk=upload.pk).update(
+            created=upload.created - timedelta(days=2))
+        self.write('posts/variants/11/11/gone-480.jpg')
+        self.write('cache/aa/bb/dead.jpg')
+        self.write('uploads/unknown.part')
+        kept = self.files() - stale - {'posts/gone.gif'}
+        past = time.time() - 2 * 60 * 60
+        for name in self.files():
+            os.utime(os.path.join(TEMP_MEDIA_ROOT, name), (past, past))
+        self.write('posts/young.gif', b'young')
+        kept = (kept - {'posts/variants/11/11/gone-480.jpg',
+                        'cache/aa/bb/dead.jpg', 'uploads/unknown.part',
+                        os.path.relpath(uploads.part_path(upload),
+                                        TEMP_MEDIA_ROOT)}
+                | {'posts/young.gif'})
+        before = self.files()
+
+        out = StringIO()
+        call_command('collect_media', '--dry-run', '--rate', '0', stdout=out)
+        self.assertEqual(self.files(), before)
+        # Миниатюры устаревших картинок в пробном запуске только
+        # подсчитываются: их записи в sorl-thumbnail остаются.
+        self.assertIn('Устаревших картинок в sorl-thumbnail: 1',
+                      out.getvalue())
+        self.assertIn('Можно удалить файлов: 5', out.getvalue())
+
+        call_command('collect_media', '--rate', '0', stdout=StringIO())
+        self.assertEqual(self.files(), kept)
+        self.assertEqual(len(stale), 1)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_variants_found_by_original_name(self):
+        """Проверяет что посты вариантов ищутся по имени оригинала"""
+        author = User.objects.create_user(username='writer')
+        digest = 'ab' * 32
+        originals = {
+            f'posts/ab/ab/{digest}.png': f'posts/variants/11/11/{digest}',
+            'posts/Legacy.GIF': 'posts/variants/22/22/Legacy',
+        }
+        for image, variant in originals.items():
+            Post.objects.create(
+                author=author, text='Пост', image=image,
+                image_variants=json.dumps({'jpeg': [
+                    {'name': f'{variant}-480.jpg', 'width': 480,
+                     'height': 170},
+                ]}),
+            )
+        names = [f'{variant}-480.jpg' for variant in originals.values()]
+        orphans = [f'posts/variants/33/33/{digest[:-1]}c-480.jpg',
+                   'posts/variants/44/44/Legacy2-480.jpg']
+        with self.assertNumQueries(1):
+            used = CollectMedia().referenced_variants(names + orphans)
+        self.assertEqual(used, set(names))
+
+    def test_variants_kept_after_shard_media(self):
+        """Проверяет что после shard_media варианты постов не удаляются"""
+        self.write('posts/old.gif')
+        variants = images.build_variants('posts/old.gif')
+        author = User.objects.create_user(username='writer')
+        post = Post.objects.create(author=author, text='Старый пост',
+                                   image='posts/old.gif',
+                                   image_variants=json.dumps(variants))
+        call_command('shard_media', stdout=StringIO())
+        post.refresh_from_db()
+        names = {entry['name']
+                 for entries in images.load_variants(post).values()
+                 for entry in entries}
+        self.assertTrue(names)
+        stem = os.path.splitext(os.path.basename(post.image.name))[0]
+        for name in names:
+            self.assertIn(f'/{stem}-', name)
+        past = time.time() - 2 * 60 * 60
+        for name in self.files():
+            os.utime(os.path.join(TEMP_MEDIA_ROOT, name), (past, past))
+
+        call_command('collect_media', '--rate', '0', stdout=StringIO())
+        self.assertLessEqual(names | {post.image.name}, self.files())
+        self.assertFalse(any('/old-' in name for name in self.files()))
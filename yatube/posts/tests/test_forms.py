@@ -1,14 +1,18 @@
 import shutil
 import tempfile
 from http import HTTPStatus
+from io import BytesIO
 
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
+from django.db import connection
 from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image, PngImagePlugin
 
 from posts.forms import PostForm, CommentForm
-from posts.models import Post, User, Group, Comment
+from posts.models import Post, User, Group, Comment, Follow
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -77,6 +81,119 @@ class PostFormTest(TestCase):
         self.assertEqual(post.group.pk, form_data.get('group'))
         self.assertEqual(post.author, self.user)
 
+    @override_settings(POSTS_IMAGE_MAX_SIZE=100)
+    def test_large_photo_normalized(self):
+        """Проверяет что крупное фото уменьшается и теряет EXIF"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010f] = 'Камера'
+        buffer = BytesIO()
+        Image.new('RGB', (300, 200), 'blue').save(buffer, 'JPEG',
+                                                  exif=exif.tobytes())
+        photo = SimpleUploadedFile('photo.jpg', buffer.getvalue(),
+                                   content_type='image/jpeg')
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с фото', 'image': photo},
+        )
+        post = Post.objects.get(text='Пост с фото')
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.size, (67, 100))
+            self.assertEqual(dict(stored.getexif()), {})
+        self.assertEqual((post.image_width, post.image_height), (67, 100))
+
+    def test_png_text_chunks_stripped(self):
+        """Проверяет что текстовые блоки PNG не попадают в хранилище"""
+        info = PngImagePlugin.PngInfo()
+        info.add_text('GPS', '55.7558 N, 37.6173 E')
+        info.add_itxt('Location', 'Москва')
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(buffer, 'PNG', pnginfo=info,
+                                             transparency=(0, 0, 0))
+        picture = SimpleUploadedFile('place.png', buffer.getvalue(),
+                                     content_type='image/png')
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с местом', 'image': picture},
+        )
+        post = Post.objects.get(text='Пост с местом')
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(set(stored.info), {'transparency'})
+
+    @override_settings(POSTS_IMAGE_MAX_SIZE=100)
+    def test_mpo_photo_normalized(self):
+        """Проверяет что MPO с камеры уменьшается, теряет EXIF и кадры"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010f] = 'Камера'
+        buffer = BytesIO()
+        Image.new('RGB', (300, 200), 'blue').save(
+            buffer, 'MPO', save_all=True, exif=exif.tobytes(),
+            append_images=[Image.new('RGB', (300, 200), 'red')])
+        photo = SimpleUploadedFile('photo.jpg', buffer.getvalue(),
+                                   content_type='image/jpeg')
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с MPO', 'image': photo},
+        )
+        post = Post.objects.get(text='Пост с MPO')
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.format, 'JPEG')
+            self.assertEqual(stored.size, (67, 100))
+            self.assertEqual(dict(stored.getexif()), {})
+
+    def test_animation_comment_stripped(self):
+        """Проверяет что из анимации убираются метаданные, а кадры
+        остаются"""
+        frames = [Image.new('RGB', (4, 4), color)
+                  for color in ('red', 'blue')]
+        buffer = BytesIO()
+        frames[0].save(buffer, 'GIF', save_all=True,
+                       append_images=frames[1:], duration=[100, 200],
+                       loop=0, comment=b'55.7558 N, 37.6173 E')
+        animation = SimpleUploadedFile('moving.gif', buffer.getvalue(),
+                                       content_type='image/gif')
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с анимацией', 'image': animation},
+        )
+        post = Post.objects.get(text='Пост с анимацией')
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.n_frames, 2)
+            self.assertNotIn('comment', stored.info)
+            self.assertEqual(stored.info['duration'], 100)
+            stored.seek(1)
+            self.assertEqual(stored.info['duration'], 200)
+
+    @override_settings(POSTS_IMAGE_MAX_SIZE=2)
+    def test_large_animation_rejected(self):
+        """Проверяет что анимация крупнее лимита не принимается"""
+        frames = [Image.new('RGB', (4, 4), color)
+                  for color in ('red', 'blue')]
+        buffer = BytesIO()
+        frames[0].save(buffer, 'GIF', save_all=True,
+                       append_images=frames[1:])
+        animation = SimpleUploadedFile('moving.gif', buffer.getvalue(),
+                                       content_type='image/gif')
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Крупная анимация', 'image': animation},
+        )
+        self.assertFalse(Post.objects.filter(
+            text='Крупная анимация').exists())
+        self.assertTrue(response.context['form'].has_error('image'))
+
+    @override_settings(POSTS_IMAGE_MAX_PIXELS=1)
+    def test_too_many_pixels_rejected(self):
+        """Проверяет что картинка сверх лимита пикселей не принимается"""
+        form = PostForm(
+            data={'text': 'Огромная картинка'},
+            files={'image': SimpleUploadedFile('big.gif', small_gif,
+                                               content_type='image/gif')},
+        )
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
     def test_base_changed(self):
         """Проверяет что после отправки формы редактируется пост"""
         new_group = Group.objects.create(
@@ -158,6 +275,11 @@ class CommentFormTest(TestCase):
         self.assertEqual(comment.text, form_data.get('text'))
         self.assertEqual(comment.post, self.post)
         self.assertEqual(comment.author, self.user)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
 
     def test_guest_can_not_add_comments(self):
         """Проверяет что гостевой пользователь
@@ -172,3 +294,18 @@ class CommentFormTest(TestCase):
             follow=True
         )
         self.assertEqual(Comment.objects.count(), prev_comments_count)
+
+    def test_post_delete_cost_independent_of_comments(self):
+        """Проверяет что удаление поста не тратит запросы на каждый
+        комментарий"""
+        reader = User.objects.create(username='reader')
+        Follow.objects.create(user=reader, author=self.user)
+        counts = []
+        for comments in (1, 10):
+            post = Post.objects.create(text='Обсуждаемый', author=self.user)
+            for _ in range(comments):
+                Comment.objects.create(post=post, author=reader, text='Да')
+            with CaptureQueriesContext(connection) as captured:
+                post.delete()
+            counts.append(len(captured))
+        self.assertEqual(counts[0], counts[1])
@@ -0,0 +1,122 @@
+import gzip
+import os
+import shutil
+import tempfile
+from http import HTTPStatus
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from posts.models import Post
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEMP_STATIC_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEMP_STATICFILES_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+small_gif = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ServeMediaTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        storage = Post._meta.get_field('image').storage
+        cls.name = storage.save('posts/small.gif', ContentFile(small_gif))
+        cls.url = settings.MEDIA_URL + cls.name
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_hashed_file_served_immutable(self):
+        """Проверяет что файл с хэшем в имени кэшируется навсегда"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(b''.join(response.streaming_content), small_gif)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        response = self.client.get(self.url,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_range_requests(self):
+        """Проверяет отдачу части файла по заголовку Range"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, HTTPStatus.PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content),
+                         small_gif[2:6])
+        self.assertEqual(response['Content-Range'],
+                         f'bytes 2-5/{len(small_gif)}')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content),
+                         small_gif[-3:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=999-')
+        self.assertEqual(response.status_code,
+                         HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    @override_settings(MEDIA_X_ACCEL_PREFIX='/internal-media/')
+    def test_transfer_offloaded_to_nginx(self):
+        """Проверяет что передачу файла можно поручить nginx"""
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/internal-media/' + self.name)
+        self.assertEqual(response.content, b'')
+
+    def test_paths_outside_media_root_hidden(self):
+        """Проверяет что за пределы MEDIA_ROOT выйти нельзя"""
+        response = self.client.get(settings.MEDIA_URL + '../manage.py')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        response = self.client.get(settings.MEDIA_URL + 'posts/nope.gif')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+@override_settings(STATIC_ROOT=TEMP_STATIC_ROOT,
+                   STATICFILES_DIRS=(TEMP_STATICFILES_DIR,))
+class ServeStaticTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.css = b'.card { margin: 0 auto; }\n' * 50
+        os.makedirs(os.path.join(TEMP_STATICFILES_DIR, 'css'))
+        with open(os.path.join(TEMP_STATICFILES_DIR, 'css', 'site.css'),
+                  'wb') as file:
+            file.write(cls.css)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_STATIC_ROOT, ignore_errors=True)
+        shutil.rmtree(TEMP_STATICFILES_DIR, ignore_errors=True)
+
+    def test_static_served_precompressed(self):
+        """Проверяет что статика с хэшем отдаётся сжатой и кэшируется"""
+        self.assertEqual(staticfiles_storage.url('css/site.css'),
+                         '/static/css/site.css')
+        call_command('collectstatic', interactive=False, verbosity=0)
+        url = staticfiles_storage.url('css/site.css')
+        self.assertRegex(url, r'^/static/css/site\.[0-9a-f]{12}\.css$')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)), self.css)
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.css)
+        response = self.client.get('/static/css/site.css')
+        self.assertNotIn('immutable', response['Cache-Control'])
@@ -0,0 +1,79 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+
+FEED_TABLES = ('posts_post', 'posts_comment', 'posts_feedentry')
+
+
+def query_plan(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(sql):
+    """Шаги плана с полным сканированием или временной сортировкой.
+
+    Проход по индексу (SCAN ... USING INDEX) допустим: так читается
+    упорядоченная лента с LIMIT.
+    """
+    problems = []
+    for step in query_plan(sql):
+        if 'TEMP B-TREE' in step:
+            problems.append(step)
+        elif (step.startswith('SCAN') and 'INDEX' not in step
+              and any(table in step for table in FEED_TABLES)):
+            problems.append(step)
+    return problems
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание'
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        posts = [Post.objects.create(author=cls.author, group=cls.group,
+                                     text=f'Пост {number}')
+                 for number in range(15)]
+        cls.post = posts[0]
+        for number in range(3):
+            Comment.objects.create(post=cls.post, author=cls.user,
+                                   text=f'Комментарий {number}')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_feed_queries_use_indexes(self):
+        """Проверяем что ленты не сканируют таблицы и не сортируют"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.author.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            for query_string in ('', '?page=2', '?cursor='):
+                with self.subTest(url=url + query_string):
+                    with CaptureQueriesContext(connection) as queries:
+                        self.client.get(url + query_string)
+                    for query in queries:
+                        sql = query['sql']
+                        if not any(table in sql for table in FEED_TABLES):
+                            continue
+                        self.assertEqual(plan_problems(sql), [], sql)
@@ -0,0 +1,254 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from core.kvstore import LRUCache
+from posts import images, thumbnails
+from posts.models import Post, User
+from posts.templatetags.post_cards import CARD_TEMPLATE
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+small_gif = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def uploaded_gif(name='small.gif'):
+    return SimpleUploadedFile(name, small_gif, content_type='image/gif')
+
+
+def uploaded_png(color, name='small.png'):
+    """Картинка 2x1 заданного цвета: разный цвет — разный файл."""
+    buffer = BytesIO()
+    Image.new('RGB', (2, 1), color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(),
+                              content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class PostImageTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='writer')
+        cls.posts = [Post.objects.create(author=cls.author,
+                                         text=f'Пост {number}',
+                                         image=uploaded_png(color))
+                     for number, color in enumerate(('red', 'green',
+                                                     'blue'))]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Записи KV-хранилища в базе откатываются после каждого теста,
+        # а кэш и LRU — нет.
+        cache.clear()
+        default.kvstore.lru.clear()
+
+    def thumbnail_keys(self, post):
+        return [add_prefix(thumbnails.thumbnail_key(post.image.name,
+                                                    geometry, options))
+                for geometry, options in settings.POSTS_THUMBNAIL_GEOMETRIES]
+
+    def evict(self):
+        default.kvstore.cache.delete_many(
+            [key for post in self.posts for key in self.thumbnail_keys(post)]
+        )
+        default.kvstore.lru.clear()
+
+    def render_cards(self, prefetch):
+        with CaptureQueriesContext(connection) as queries:
+            if prefetch:
+                thumbnails.prefetch(self.posts)
+            for post in self.posts:
+                render_to_string(CARD_TEMPLATE, {'post': post})
+        return len(queries)
+
+    def test_page_thumbnails_loaded_in_one_query(self):
+        """Проверяет что миниатюры страницы ищутся одним запросом"""
+        for post in self.posts:
+            thumbnails.generate(post.image.name)
+        self.evict()
+        self.assertEqual(self.render_cards(prefetch=False), len(self.posts))
+        self.evict()
+        self.assertEqual(self.render_cards(prefetch=True), 1)
+        self.assertEqual(self.render_cards(prefetch=True), 0)
+
+    def test_image_change_forgets_thumbnails(self):
+        """Проверяет что при замене картинки её миниатюры забываются"""
+        post = Post.objects.get(pk=self.posts[0].pk)
+        thumbnails.generate(post.image.name)
+        old_keys = self.thumbnail_keys(post)
+        self.assertIsNotNone(default.kvstore._get_raw(old_keys[0]))
+        post.image = uploaded_png('white')
+        post.save()
+        self.assertIsNone(default.kvstore._get_raw(old_keys[0]))
+
+    def test_variants_rendered_as_picture(self):
+        """Проверяет что готовые варианты выводятся через <picture>"""
+        post = self.posts[1]
+        thumbnails.save_variants(post.image.name,
+                                 thumbnails.generate(post.image.name))
+        post = Post.objects.get(pk=post.pk)
+        variants = images.load_variants(post)
+        self.assertIn('webp', variants)
+        self.assertIn('jpeg', variants)
+        response = self.client.get(reverse('posts:post_detail',
+                                           args=(post.pk,)))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(
+            response, default_storage.url(variants['jpeg'][0]['name'])
+        )
+
+    def test_variants_reused_on_rebuild(self):
+        """Проверяет что повторная нарезка не плодит файлы вариантов"""
+        name = self.posts[2].image.name
+        first = images.build_variants(name)
+        directory = os.path.dirname(
+            default_storage.path(first['jpeg'][0]['name']))
+        files = sorted(os.listdir(directory))
+        self.assertEqual(images.build_variants(name), first)
+        self.assertEqual(sorted(os.listdir(directory)), files)
+
+    def test_metadata_filled_on_upload(self):
+        """Проверяет что размеры и заглушка считаются при загрузке"""
+        post = Post.objects.get(pk=self.posts[0].pk)
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertTrue(post.image_placeholder.startswith('data:image/'))
+        html = render_to_string(CARD_TEMPLATE, {'post': post})
+        self.assertIn('loading="lazy"', html)
+        self.assertIn(post.image_placeholder, html)
+
+    def test_backfill_fills_metadata(self):
+        """Проверяет что команда заполняет размеры старых картинок"""
+        Post.objects.update(image_width=None, image_height=None,
+                            image_placeholder='')
+        call_command('backfill_image_metadata', stdout=StringIO())
+        self.assertEqual(
+            set(Post.objects.values_list('image_width', 'image_height')),
+            {(2, 1)}
+        )
+
+
+class LRUCacheTest(TestCase):
+    def test_evicts_least_recently_used(self):
+        """Проверяет что LRU вытесняет давно не читанные записи"""
+        lru = LRUCache(size=2, timeout=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')),
+                         (1, None, 3))
+
+    def test_expired_entries_dropped(self):
+        """Проверяет что записи LRU устаревают по времени"""
+        lru = LRUCache(size=2, timeout=-1)
+        lru.set('a', 1)
+        self.assertIsNone(lru.get('a'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageReleaseTest(TransactionTestCase):
+    """Удаление файлов откладывается до фиксации транзакции."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='writer')
+
+    def test_image_change_drops_variants(self):
+        """Проверяет что при замене картинки старые варианты удаляются"""
+        post = Post.objects.create(author=self.author, text='Пост',
+                                   image=uploaded_png('red'))
+        thumbnails.save_variants(post.image.name,
+                                 thumbnails.generate(post.image.name))
+        post = Post.objects.get(pk=post.pk)
+        names = [entry['name']
+                 for entries in images.load_variants(post).values()
+                 for entry in entries]
+        post.image = uploaded_png('white')
+        post.save()
+        self.assertEqual(Post.objects.get(pk=post.pk).image_variants, '')
+        self.assertFalse(any(default_storage.exists(name)
+                             for name in names))
+
+    def test_shared_file_kept_until_last_post(self):
+        """Проверяет что общий файл живёт, пока на него есть ссылки"""
+        first, second = (Post.objects.create(author=self.author,
+                                             text=f'Пост {number}',
+                                             image=uploaded_gif())
+                         for number in range(2))
+        self.assertEqual(first.image.name, second.image.name)
+        name = first.image.name
+        first.delete()
+        self.assertTrue(default_storage.exists(name))
+        second.delete()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_duplicate_reuses_variants(self):
+        """Проверяет что дубликат берёт готовые варианты без нарезки"""
+        original = Post.objects.create(author=self.author, text='Пост',
+                                       image=uploaded_gif())
+        thumbnails.save_variants(original.image.name,
+                                 thumbnails.generate(original.image.name))
+        duplicate = Post.objects.create(author=self.author, text='Копия',
+                                        image=uploaded_gif())
+        thumbnails.schedule(duplicate)
+        self.assertEqual(
+            Post.objects.get(pk=duplicate.pk).image_variants,
+            Post.objects.get(pk=original.pk).image_variants,
+        )
+
+    def test_pool_thread_connection_closed(self):
+        """Проверяет что поток пула закрывает своё соединение с базой, а
+        поток запроса — нет"""
+        post = Post.objects.create(author=self.author, text='Пост',
+                                   image=uploaded_gif())
+        future = Future()
+        future.set_result({'jpeg': []})
+        args = (post.image.name, threading.get_ident(), future)
+        patcher = mock.patch.object(thumbnails, '_pending', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with mock.patch.object(thumbnails, 'connection') as db:
+            thread = threading.Thread(target=thumbnails.task_done,
+                                      args=args)
+            thread.start()
+            thread.join()
+            self.assertEqual(db.close.call_count, 1)
+            thumbnails.task_done(*args)
+            self.assertEqual(db.close.call_count, 1)
+        self.assertEqual(Post.objects.get(pk=post.pk).image_variants,
+                         json.dumps({'jpeg': []}))
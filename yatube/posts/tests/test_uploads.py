@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+from http import HTTPStatus
+from unittest import mock
+
+from django.conf import settings
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import ChunkedUpload, Post, User
+from posts.uploads import AssembledUpload, part_path
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+small_gif = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ChunkedUploadTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def start(self):
+        response = self.authorized_client.post(
+            reverse('posts:upload_create'),
+            {'filename': 'small.gif', 'size': len(small_gif)},
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        return reverse('posts:upload_detail', args=(response.json()['id'],))
+
+    def send(self, url, offset, chunk):
+        return self.authorized_client.patch(
+            url, chunk, content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_upload_resumes_from_offset(self):
+        """Проверяет что загрузка продолжается с полученного смещения"""
+        url = self.start()
+        self.send(url, 0, small_gif[:10])
+        offset = self.authorized_client.get(url).json()['offset']
+        self.assertEqual(offset, 10)
+        response = self.send(url, 0, small_gif[:10])
+        self.assertEqual(response.status_code, HTTPStatus.CONFLICT)
+        self.assertEqual(response.json()['offset'], 10)
+        response = self.send(url, offset, small_gif[offset:])
+        self.assertTrue(response.json()['complete'])
+
+    def test_chunk_beyond_size_rejected(self):
+        """Проверяет что часть сверх объявленного размера отклоняется"""
+        url = self.start()
+        response = self.send(url, 0, small_gif + b'lishnee')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_post_created_from_upload(self):
+        """Проверяет что собранный файл прикрепляется к новому посту"""
+        url = self.start()
+        self.send(url, 0, small_gif)
+        upload = ChunkedUpload.objects.get()
+        path = part_path(upload)
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            {'text': 'Пост из частей', 'upload_id': str(upload.pk)},
+        )
+        post = Post.objects.get(text='Пост из частей')
+        with post.image.open() as image:
+            self.assertEqual(image.read(), small_gif)
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_upload_closed_when_form_invalid(self):
+        """Проверяет что собранный файл закрывается и при ошибках формы"""
+        url = self.start()
+        self.send(url, 0, small_gif)
+        upload = ChunkedUpload.objects.get()
+        with mock.patch.object(AssembledUpload, 'close',
+                               autospec=True) as close:
+            response = self.authorized_client.post(
+                reverse('posts:post_create'),
+                {'text': '', 'upload_id': str(upload.pk)},
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(Post.objects.exists())
+        close.assert_called_once()
+        self.assertTrue(ChunkedUpload.objects.exists())
+
+    def test_incomplete_upload_not_attached(self):
+        """Проверяет что незавершённую загрузку нельзя прикрепить"""
+        url = self.start()
+        self.send(url, 0, small_gif[:10])
+        upload = ChunkedUpload.objects.get()
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            {'text': 'Пост из частей', 'upload_id': str(upload.pk)},
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertFalse(Post.objects.exists())
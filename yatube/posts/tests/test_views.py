@@ -1,14 +1,21 @@
+import json
+import logging
 import shutil
 import tempfile
+from http import HTTPStatus
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
-from posts.models import Post, Group, User, Follow
+from core.profiling import RequestProfile, profiled_cache
+from posts import versions, views
+from posts.models import Comment, Post, Group, User, Follow
 from posts.forms import PostForm
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -58,6 +65,12 @@ class PostPagesTests(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        # TestCase не фиксирует транзакции, а версии лент сдвигаются
+        # только после фиксации: здесь пусть сдвигаются сразу.
+        patcher = mock.patch('posts.versions.on_commit',
+                             lambda func: func())
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.author_client = Client()
         self.author_client.force_login(self.author)
         self.user_client = Client()
@@ -192,15 +205,119 @@ class PostPagesTests(TestCase):
         """Проверяет кэширование главной страницы"""
         content_first = self.client.get(reverse('posts:index')).content
 
-        self.post.delete()
+        Post.objects.filter(pk=self.post.pk).update(text='Мимо сигналов')
 
         content_second = self.client.get(reverse('posts:index')).content
         self.assertEqual(content_first, content_second)
 
         cache.clear()
 
+        content_third = self.client.get(reverse('posts:index')).content
+        self.assertNotEqual(content_second, content_third)
+
+        self.post.delete()
+
         content_last = self.client.get(reverse('posts:index')).content
-        self.assertNotEqual(content_second, content_last)
+        self.assertNotEqual(content_third, content_last)
+
+    def test_cache_versions_invalidate_feeds(self):
+        """Проверяет что изменения сбрасывают кэш только своих лент"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.author.username,)),
+            reverse('posts:follow_index'),
+        )
+        before = [self.user_client.get(url).content for url in urls]
+        Post.objects.create(author=self.author, text='Новый пост',
+                            group=self.group)
+        after = [self.user_client.get(url).content for url in urls]
+        for url, old, new in zip(urls, before, after):
+            with self.subTest(url=url):
+                self.assertNotEqual(old, new)
+                self.assertIn('Новый пост', new.decode())
+        other_group = Group.objects.create(title='Чужая', slug='other',
+                                           description='Чужая группа')
+        other_url = reverse('posts:group_list', args=(other_group.slug,))
+        content = self.user_client.get(other_url).content
+        Post.objects.create(author=self.author_2, text='Мимо подписок')
+        self.assertEqual(self.user_client.get(other_url).content, content)
+        self.assertNotIn(
+            'Мимо подписок',
+            self.user_client.get(reverse('posts:follow_index'))
+            .content.decode()
+        )
+
+    def test_renames_invalidate_pages(self):
+        """Проверяет что переименование группы и автора видно сразу на
+        всех страницах с их постами"""
+        urls = (
+            reverse('posts:profile', args=(self.author.username,)),
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+        etags = [self.user_client.get(url)['ETag'] for url in urls]
+        Group.objects.filter(pk=self.group.pk).update(title='Переименована')
+        for url in urls[:2]:
+            self.assertNotContains(self.user_client.get(url),
+                                   '#Переименована')
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новое имя'
+        group.save()
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name = 'Переименованный'
+        author.save()
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                if url != urls[2]:
+                    self.assertContains(response, '#Новое имя')
+                self.assertContains(response, 'Переименованный')
+
+    def test_post_cards_reused_between_pages(self):
+        """Проверяет что карточки постов рендерятся один раз на все ленты"""
+        cache.clear()
+        response = self.user_client.get(reverse('posts:index'))
+        self.assertTemplateUsed(response, 'posts/includes/post_card.html')
+        response = self.user_client.get(reverse('posts:follow_index'))
+        self.assertTemplateNotUsed(response, 'posts/includes/post_card.html')
+        self.assertContains(response, self.post.text)
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Исправленный текст'
+        post.save()
+        response = self.user_client.get(reverse('posts:follow_index'))
+        self.assertTemplateUsed(response, 'posts/includes/post_card.html')
+        self.assertContains(response, 'Исправленный текст')
+
+    def test_feeds_answer_not_modified(self):
+        """Проверяет ответы 304 на повторные запросы лент и поста"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.author.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                # Первый ответ может выдать CSRF-cookie, от него зависит ETag
+                self.user_client.get(url)
+                response = self.user_client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                etag = response['ETag']
+                response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+                response = self.author_client.get(url,
+                                                  HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+        response = self.client.get(urls[0])
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        Post.objects.create(author=self.author, text='Свежий пост')
+        response = self.client.get(urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
 
 
 class PaginatorViewsTest(TestCase):
@@ -251,3 +368,205 @@ class PaginatorViewsTest(TestCase):
                             url, args=args) + page)
                         self.assertEqual(len(response.context.get(
                             'page_obj')), posts_amount)
+
+    def test_cursor_pages_walk_through_all_posts(self):
+        """Проверяем что курсорные страницы обходят все посты без COUNT"""
+        url_names_with_args = (
+            ('posts:index', None),
+            ('posts:profile', (self.author,)),
+            ('posts:group_list', (self.group.slug,)),
+            ('posts:follow_index', None)
+        )
+        for url, args in url_names_with_args:
+            with self.subTest(url=url):
+                cache.clear()
+                response = self.follower_client.get(
+                    reverse(url, args=args) + '?cursor=')
+                first_page = response.context.get('page_obj')
+                self.assertEqual(len(first_page), settings.POSTS_SHOW_AMOUNT)
+                self.assertFalse(first_page.has_previous())
+                response = self.follower_client.get(
+                    reverse(url, args=args)
+                    + f'?cursor={first_page.next_cursor}')
+                second_page = response.context.get('page_obj')
+                self.assertEqual(len(second_page), self.POSTS_SHOW_REMAINING)
+                self.assertFalse(second_page.has_next())
+                response = self.follower_client.get(
+                    reverse(url, args=args)
+                    + f'?cursor={second_page.previous_cursor}')
+                self.assertEqual(
+                    [post.pk for post in response.context.get('page_obj')],
+                    [post.pk for post in first_page]
+                )
+
+
+class SearchViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='search_author')
+        cls.post = Post.objects.create(
+            text='Сегодня видел <b>жирафа</b> в зоопарке',
+            author=cls.author,
+        )
+        cls.other_post = Post.objects.create(
+            text='Про котов и собак',
+            author=cls.author,
+        )
+        Comment.objects.create(
+            post=cls.other_post,
+            author=cls.author,
+            text='А жирафы тут при чём?',
+        )
+
+    def test_search_finds_posts_and_comments(self):
+        """Проверяем что поиск находит посты и комментарии с подсветкой"""
+        response = self.client.get(reverse('posts:search'), {'q': 'жираф'})
+        hits = list(response.context.get('page_obj'))
+        self.assertEqual({hit.post for hit in hits},
+                         {self.post, self.other_post})
+        post_hit = next(hit for hit in hits if not hit.in_comment)
+        self.assertIn('<mark>жирафа</mark>', post_hit.snippet)
+        self.assertIn('&lt;b&gt;', post_hit.snippet)
+
+    def test_search_index_follows_edits(self):
+        """Проверяем что индекс обновляется при изменении и удалении"""
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Теперь про бегемота'
+        post.save()
+        response = self.client.get(reverse('posts:search'), {'q': 'жираф'})
+        self.assertEqual([hit.post for hit in response.context['page_obj']],
+                         [self.other_post])
+        Comment.objects.all().delete()
+        response = self.client.get(reverse('posts:search'), {'q': 'жираф'})
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    def test_search_survives_query_syntax(self):
+        """Проверяем что операторы FTS5 в запросе не ломают поиск"""
+        response = self.client.get(reverse('posts:search'),
+                                   {'q': '"котов OR* (NEAR'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class VersionsTest(TestCase):
+    def test_bump_waits_for_commit(self):
+        """Проверяет что версия сдвигается только после фиксации"""
+        key = versions.global_key()
+        old = versions.get_version(key)
+        with mock.patch('posts.versions.on_commit') as on_commit:
+            versions.bump(key)
+        self.assertEqual(versions.get_version(key), old)
+        on_commit.call_args[0][0]()
+        self.assertNotEqual(versions.get_version(key), old)
+
+
+@override_settings(QUERY_BUDGET_CHECK=True)
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='writer')
+        group = Group.objects.create(title='Группа', slug='group',
+                                     description='Описание')
+        Post.objects.create(author=author, text='Пост', group=group)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_over_budget_logged_with_origin(self):
+        """Проверяет что превышение бюджета пишется в лог с шаблонами"""
+        with mock.patch.object(views.index, 'query_budget', 1):
+            with self.assertLogs('core.middleware', 'WARNING') as logs:
+                self.client.get(reverse('posts:index'))
+        self.assertIn('posts:index', logs.output[0])
+        self.assertIn('[posts/index.html:', logs.output[0])
+
+    @override_settings(QUERY_BUDGET_CHECK=None)
+    def test_default_checks_only_under_debug(self):
+        """Проверяет что по умолчанию бюджет проверяется только при DEBUG"""
+        with mock.patch.object(views.index, 'query_budget', 1):
+            with self.assertNoLogs('core.middleware', 'WARNING'):
+                self.client.get(reverse('posts:index'))
+            cache.clear()
+            with self.settings(DEBUG=True, PROFILING_SAMPLE_RATE=0):
+                with self.assertLogs('core.middleware', 'WARNING'):
+                    self.client.get(reverse('posts:index'))
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1)
+class ProfilingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='writer')
+        Post.objects.create(author=author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        # Строки профилей не нужны в выводе тестов.
+        patcher = mock.patch.object(logging.getLogger('core.profiling'),
+                                    'handlers', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_logging_configured(self):
+        """Проверяет что профили пишутся на уровне INFO"""
+        logger = logging.getLogger('core.profiling')
+        self.assertTrue(logger.isEnabledFor(logging.INFO))
+
+    def test_server_timing_and_log(self):
+        """Проверяет что замеры попадают в Server-Timing и в лог"""
+        with self.assertLogs('core.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('posts:index'))
+        self.assertRegex(response['Server-Timing'],
+                         r'^sql;dur=[\d.]+;desc="[1-9]\d* queries", '
+                         r'tpl;dur=[\d.]+;desc="templates", '
+                         r'cache;desc="\d+ hits, [1-9]\d* misses", '
+                         r'total;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'posts:index')
+        self.assertEqual(record['status'], HTTPStatus.OK)
+        self.assertGreater(record['template_ms'], 0)
+
+    def test_cache_hits_counted(self):
+        """Проверяет что повторный запрос попадает в кэш"""
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(reverse('posts:index'))
+        self.assertRegex(response['Server-Timing'],
+                         r'cache;desc="[1-9]\d* hits, 0 misses"')
+
+    def test_any_cache_backend_counted(self):
+        """Проверяет что попадания считаются для любого бэкенда кэша"""
+        with tempfile.TemporaryDirectory() as location:
+            backend = profiled_cache(location, {
+                'PROFILED_BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+            })
+            self.assertIsInstance(backend, FileBasedCache)
+            backend.set('key', 1)
+            with RequestProfile() as profile:
+                backend.get('key')
+                backend.get('other')
+                backend.get_many(['key', 'other'])
+        self.assertEqual((profile.cache_hits, profile.cache_misses), (2, 2))
+
+    def test_users_views_profiled(self):
+        """Проверяет что профилируются и страницы входа"""
+        response = self.client.get(reverse('users:login'))
+        self.assertIn('Server-Timing', response)
+
+    @override_settings(PROFILING_NAMESPACES=('users',))
+    def test_other_namespaces_skipped(self):
+        """Проверяет что вне PROFILING_NAMESPACES замеры не отдаются"""
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PROFILING_SAMPLE_RATE=0.5)
+    def test_sampling(self):
+        """Проверяет что профилируется только доля запросов"""
+        with mock.patch('core.middleware.random.random',
+                        side_effect=[0.7, 0.2]):
+            skipped = self.client.get(reverse('users:login'))
+            sampled = self.client.get(reverse('users:login'))
+        self.assertNotIn('Server-Timing', skipped)
+        self.assertIn('Server-Timing', sampled)
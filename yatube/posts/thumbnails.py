@@ -0,0 +1,220 @@
+"""Заблаговременная нарезка миниатюр картинок постов.
+
+sorl-thumbnail режет миниатюру при первом показе страницы, и читатель
+ждёт, пока Pillow декодирует и пережмёт оригинал. Здесь все размеры из
+POSTS_THUMBNAIL_GEOMETRIES и адаптивные варианты готовятся заранее в
+ограниченном пуле процессов, а поток запроса только ставит задачу в
+очередь. Описание вариантов сохраняет уже родительский процесс.
+"""
+import functools
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import connection, transaction
+from sorl.thumbnail import default, delete, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from . import images
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = 0
+_lock = threading.Lock()
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def source_file(name):
+    """Исходник для sorl с хранилищем поля Post.image.
+
+    Ключи sorl включают хранилище, так что без него ключи разошлись бы
+    с теми, что ищет тег {% thumbnail post.image %}.
+    """
+    return ImageFile(name, Post._meta.get_field('image').storage)
+
+
+def generate(name, with_variants=True):
+    """Режет миниатюры и варианты файла; выполняется в пуле.
+
+    Возвращает описание вариантов для save_variants.
+    """
+    for geometry, options in settings.POSTS_THUMBNAIL_GEOMETRIES:
+        get_thumbnail(source_file(name), geometry, **options)
+    if with_variants:
+        return images.build_variants(name)
+    return None
+
+
+def save_variants(name, variants):
+    """Записывает варианты в посты, у которых всё ещё эта картинка."""
+    if variants is None:
+        return
+    for post in Post.objects.filter(image=name, image_variants=''):
+        post.image_variants = json.dumps(variants)
+        post.save(update_fields=('image_variants', 'updated'))
+
+
+def create_executor(workers):
+    # spawn, а не fork: дочерний процесс не наследует соединения с БД
+    # и потоки сервера приложений.
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+    )
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = create_executor(settings.POSTS_THUMBNAIL_WORKERS)
+    return _executor
+
+
+def task_done(name, submitter, future):
+    """Сохраняет варианты готовой задачи.
+
+    Обычно вызывается в служебном потоке пула: его соединение с базой
+    не закрывает ни обработка запросов, ни CONN_MAX_AGE, поэтому оно
+    закрывается здесь же. В потоке, поставившем задачу (если она успела
+    выполниться до add_done_callback), соединение остаётся запросу.
+    """
+    global _pending
+    with _lock:
+        _pending -= 1
+    if future.exception() is not None:
+        logger.error('Не удалось нарезать миниатюры %s', name,
+                     exc_info=future.exception())
+        return
+    try:
+        save_variants(name, future.result())
+    except Exception:
+        logger.exception('Не удалось сохранить варианты %s', name)
+    finally:
+        if threading.get_ident() != submitter:
+            connection.close()
+
+
+def submit(name):
+    """Ставит файл в очередь пула.
+
+    Если очередь переполнена, задача отбрасывается: миниатюру тогда
+    нарежет sorl при первом показе, а варианты — generate_thumbnails.
+    """
+    global _pending
+    if not settings.POSTS_THUMBNAIL_WORKERS:
+        return False
+    with _lock:
+        if _pending >= settings.POSTS_THUMBNAIL_QUEUE_LIMIT:
+            logger.warning('Очередь миниатюр переполнена, %s пропущен', name)
+            return False
+        _pending += 1
+    try:
+        future = get_executor().submit(generate, name)
+    except RuntimeError:
+        with _lock:
+            _pending -= 1
+        logger.exception('Пул миниатюр недоступен')
+        return False
+    future.add_done_callback(functools.partial(task_done, name,
+                                               threading.get_ident()))
+    return True
+
+
+def reuse_variants(post):
+    """Берёт варианты у другого поста с той же картинкой.
+
+    Одинаковые файлы хранятся под одним именем, так что миниатюры sorl
+    для них уже нарезаны, а варианты можно просто скопировать.
+    """
+    variants = (Post.objects
+                .filter(image=post.image.name)
+                .exclude(pk=post.pk)
+                .exclude(image_variants='')
+                .values_list('image_variants', flat=True)
+                .first())
+    if variants is None:
+        return False
+    post.image_variants = variants
+    post.save(update_fields=('image_variants', 'updated'))
+    return True
+
+
+def schedule(post):
+    """Нарезает миниатюры картинки поста после фиксации транзакции."""
+    if post.image and not reuse_variants(post):
+        name = post.image.name
+        transaction.on_commit(lambda: submit(name))
+
+
+def thumbnail_key(name, geometry, options):
+    """Ключ миниатюры в KV-хранилище, как его считает get_thumbnail.
+
+    Опции дополняются по тем же правилам, что и в ThumbnailBackend,
+    иначе ключ не совпадёт с тем, что ищет тег {% thumbnail %}.
+    """
+    backend = default.backend
+    source = source_file(name)
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    filename = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(filename, default.storage).key
+
+
+def prefetch(posts):
+    """Достаёт метаданные миниатюр всей страницы одной пачкой."""
+    if not hasattr(default.kvstore, 'prefetch'):
+        return
+    # Картинки с готовыми вариантами выводятся без sorl-thumbnail.
+    keys = [thumbnail_key(post.image.name, geometry, options)
+            for post in posts if post.image and not post.image_variants
+            for geometry, options in settings.POSTS_THUMBNAIL_GEOMETRIES]
+    if keys:
+        default.kvstore.prefetch(keys)
+
+
+def invalidate(name):
+    """Забывает миниатюры файла, который больше не картинка поста."""
+    if name:
+        delete(source_file(name), delete_file=False)
+
+
+def release(name, variants):
+    """Освобождает картинку, на которую больше не ссылается ни один пост.
+
+    Миниатюры забываются сразу, а файлы картинки и вариантов удаляются
+    после фиксации транзакции, когда ссылки проверяются ещё раз.
+    """
+    if not name or Post.objects.filter(image=name).exists():
+        return
+    invalidate(name)
+
+    def delete_files():
+        if Post.objects.filter(image=name).exists():
+            return
+        images.delete_variants(variants)
+        try:
+            Post._meta.get_field('image').storage.delete(name)
+        except SuspiciousFileOperation:
+            logger.warning('Картинка вне MEDIA_ROOT не удалена: %s', name)
+
+    transaction.on_commit(delete_files)
@@ -0,0 +1,143 @@
+"""Загрузка картинок по частям с докачкой.
+
+POST uploads/ с полями filename и size заводит загрузку, PATCH
+uploads/<id>/ с заголовком Upload-Offset дописывает тело запроса с
+этого места, GET uploads/<id>/ сообщает, сколько байт уже получено.
+Части пишутся сразу в файл под MEDIA_ROOT, поэтому обрыв связи теряет
+только последнюю часть. Собранный файл передаётся в post_create и
+post_edit полем upload_id и дальше проходит через PostForm как обычная
+загрузка.
+"""
+import mimetypes
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.db.models import F
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from .models import ChunkedUpload
+
+BLOCK_SIZE = 64 * 1024
+
+
+class OffsetMismatch(Exception):
+    """Клиент шлёт часть не с того места, где остановилась загрузка."""
+
+    def __init__(self, offset):
+        super().__init__(offset)
+        self.offset = offset
+
+
+class AssembledUpload(UploadedFile):
+    """Собранный файл; Django переносит его на место без копирования."""
+
+    def __init__(self, upload):
+        super().__init__(
+            file=open(part_path(upload), 'rb'),
+            name=upload.filename,
+            content_type=mimetypes.guess_type(upload.filename)[0],
+            size=upload.size,
+        )
+        self.upload = upload
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def part_path(upload):
+    return os.path.join(settings.MEDIA_ROOT, settings.POSTS_UPLOAD_DIR,
+                        f'{upload.pk}.part')
+
+
+def start(user, filename, size):
+    """Заводит загрузку и пустой файл под её части."""
+    filename = os.path.basename(filename or '')
+    if not filename or len(filename) > 255:
+        raise ValidationError('Некорректное имя файла.')
+    if not 0 < size <= settings.POSTS_IMAGE_MAX_BYTES:
+        raise ValidationError(
+            'Файл больше %(limit)d МБ.',
+            params={'limit': settings.POSTS_IMAGE_MAX_BYTES // 2 ** 20},
+        )
+    upload = ChunkedUpload.objects.create(user=user, filename=filename,
+                                          size=size)
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return upload
+
+
+def append(upload, offset, stream, length):
+    """Дописывает часть из потока запроса, не читая её в память целиком.
+
+    Смещение сдвигается условным UPDATE: если параллельный запрос уже
+    записал эту часть, вызывающий получит OffsetMismatch.
+    """
+    if offset != upload.offset:
+        raise OffsetMismatch(upload.offset)
+    if length > settings.POSTS_UPLOAD_CHUNK_SIZE:
+        raise ValidationError('Часть больше допустимого размера.')
+    if offset + length > upload.size:
+        raise ValidationError('Часть выходит за объявленный размер.')
+    written = 0
+    with open(part_path(upload), 'r+b') as part:
+        part.seek(offset)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            part.write(block)
+            written += len(block)
+    moved = (ChunkedUpload.objects
+             .filter(pk=upload.pk, offset=offset)
+             .update(offset=F('offset') + written))
+    if not moved:
+        upload.refresh_from_db()
+        raise OffsetMismatch(upload.offset)
+    upload.offset = offset + written
+    return upload
+
+
+def get_completed(user, upload_id):
+    """Завершённая загрузка пользователя или 404."""
+    try:
+        return get_object_or_404(ChunkedUpload, pk=upload_id, user=user,
+                                 offset=F('size'))
+    except ValidationError:
+        raise Http404
+
+
+@contextmanager
+def post_files(request):
+    """Файлы для PostForm: обычные или собранные из частей.
+
+    Собранный файл закрывается при выходе из блока, каким бы ни был
+    исход: пост сохранён, форма с ошибками или исключение.
+    """
+    upload_id = request.POST.get('upload_id')
+    if not upload_id:
+        yield request.FILES or None
+        return
+    files = request.FILES.copy()
+    image = AssembledUpload(get_completed(request.user, upload_id))
+    files['image'] = image
+    try:
+        yield files
+    finally:
+        image.close()
+
+
+def finish(files):
+    """Убирает загрузку по частям, когда файл уже прикреплён к посту."""
+    image = files.get('image') if files else None
+    if not isinstance(image, AssembledUpload):
+        return
+    image.close()
+    path = part_path(image.upload)
+    if os.path.exists(path):
+        os.remove(path)
+    image.upload.delete()
@@ -14,6 +14,9 @@ urlpatterns = [
     path('profile/<username>/',
          views.profile,
          name='profile'),
+    path('search/',
+         views.search,
+         name='search'),
     path('posts/<int:post_id>/',
          views.post_detail,
          name='post_detail'),
@@ -23,6 +26,12 @@ urlpatterns = [
     path('posts/<int:post_id>/edit/',
          views.post_edit,
          name='post_edit'),
+    path('uploads/',
+         views.upload_create,
+         name='upload_create'),
+    path('uploads/<uuid:upload_id>/',
+         views.upload_detail,
+         name='upload_detail'),
     path('posts/<int:post_id>/comment/',
          views.add_comment,
          name='add_comment'),
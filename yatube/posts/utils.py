@@ -1,9 +1,158 @@
+import base64
+import binascii
+
 from django.core.paginator import Paginator
 from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+CURSOR_FORWARD = 'n'
+CURSOR_BACKWARD = 'p'
+
+
+def batches(iterator, size):
+    """Режет поток на списки не длиннее size."""
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class LazyMap:
+    """Ленивая проекция списка: источник читается при первом обращении.
+
+    Нужна, чтобы закэшированная страница не выполняла запрос к ленте.
+    """
+
+    def __init__(self, items, func):
+        self.items = items
+        self.func = func
+
+    @cached_property
+    def mapped(self):
+        return [self.func(item) for item in self.items]
+
+    def __len__(self):
+        return len(self.mapped)
+
+    def __iter__(self):
+        return iter(self.mapped)
+
+    def __getitem__(self, index):
+        return self.mapped[index]
+
+
+def encode_cursor(obj, direction=CURSOR_FORWARD):
+    """Непрозрачный токен позиции по ключу (pub_date, pk)."""
+    raw = f'{direction}|{obj.pub_date.isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Разбирает токен; для испорченного возвращает None."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        direction, pub_date, pk = raw.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if direction not in (CURSOR_FORWARD, CURSOR_BACKWARD) or not pub_date:
+        return None
+    return direction, pub_date, pk
+
+
+class CursorPage:
+    """Страница курсорной пагинации: без COUNT(*) и без OFFSET."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self)}>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def cursor_paginate(obj, token, per_page):
+    cursor = decode_cursor(token)
+    if cursor is None:
+        direction, position = CURSOR_FORWARD, None
+    else:
+        direction, pub_date, pk = cursor
+        if direction == CURSOR_FORWARD:
+            position = (Q(pub_date__lt=pub_date)
+                        | Q(pub_date=pub_date, pk__lt=pk))
+        else:
+            position = (Q(pub_date__gt=pub_date)
+                        | Q(pub_date=pub_date, pk__gt=pk))
+    if direction == CURSOR_FORWARD:
+        obj = obj.order_by('-pub_date', '-pk')
+    else:
+        obj = obj.order_by('pub_date', 'pk')
+    if position is not None:
+        obj = obj.filter(position)
+    object_list = list(obj[:per_page + 1])
+    has_more = len(object_list) > per_page
+    object_list = object_list[:per_page]
+    if direction == CURSOR_BACKWARD:
+        object_list.reverse()
+    if not object_list:
+        return CursorPage(object_list)
+    first, last = object_list[0], object_list[-1]
+    if direction == CURSOR_FORWARD:
+        has_next, has_previous = has_more, position is not None
+    else:
+        has_next, has_previous = True, has_more
+    return CursorPage(
+        object_list,
+        next_cursor=encode_cursor(last) if has_next else None,
+        previous_cursor=(encode_cursor(first, CURSOR_BACKWARD)
+                         if has_previous else None),
+    )
+
 
+def paginate(request, obj, cursor=False):
+    """Пагинация списка постов.
 
-def paginate(request, obj):
+    По умолчанию — нумерованные страницы. Если view разрешает курсорный
+    режим (cursor=True) и в запросе передан ?cursor=, страница строится
+    по ключу (pub_date, pk). Глубже POSTS_CURSOR_AFTER_PAGE нумерованные
+    страницы ведут дальше уже по курсору.
+    """
+    if cursor and 'cursor' in request.GET:
+        return cursor_paginate(obj, request.GET['cursor'],
+                               settings.POSTS_SHOW_AMOUNT)
     paginator = Paginator(obj, settings.POSTS_SHOW_AMOUNT)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    if (cursor and page_obj.has_next()
+            and page_obj.number >= settings.POSTS_CURSOR_AFTER_PAGE):
+        page_obj.next_cursor = encode_cursor(page_obj[-1])
     return page_obj
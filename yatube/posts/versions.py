@@ -0,0 +1,84 @@
+"""Версии (поколения) закэшированных фрагментов лент.
+
+Каждая лента кэшируется под ключом, включающим версию её области:
+общая лента, группа, автор, лента подписок пользователя, пост. Сигналы
+моделей сдвигают версии ровно тех областей, содержимое которых
+изменилось, поэтому с общим для всех процессов кэшем фрагменты можно
+хранить часами (см. POSTS_VERSION_TIMEOUT в настройках). Версия —
+отметка времени изменения.
+"""
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.transaction import on_commit
+
+PREFIX = 'posts:version'
+
+
+def version_key(scope, pk=None):
+    if pk is None:
+        return f'{PREFIX}:{scope}'
+    return f'{PREFIX}:{scope}:{pk}'
+
+
+def global_key():
+    return version_key('global')
+
+
+def group_key(group_id):
+    return version_key('group', group_id)
+
+
+def author_key(user_id):
+    return version_key('author', user_id)
+
+
+def feed_key(user_id):
+    return version_key('feed', user_id)
+
+
+def post_key(post_id):
+    return version_key('post', post_id)
+
+
+def new_version():
+    return f'{time.time():.6f}'
+
+
+def get_versions(*keys):
+    """Текущие версии областей; отсутствующие заводятся заново."""
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=settings.POSTS_VERSION_TIMEOUT)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def get_version(key):
+    return get_versions(key)[0]
+
+
+def bump(*keys):
+    """Сдвигает версии областей, делая их фрагменты устаревшими.
+
+    Версии сдвигаются после фиксации транзакции: иначе параллельный
+    запрос мог бы увидеть новую версию раньше новых строк и положить в
+    кэш старое содержимое под новым ключом.
+    """
+    keys = {key for key in keys if key is not None}
+    if keys:
+        on_commit(lambda: store(keys))
+
+
+def store(keys):
+    cache.set_many({key: new_version() for key in keys},
+                   timeout=settings.POSTS_VERSION_TIMEOUT)
+
+
+def changed_at(versions):
+    """Время последнего изменения по версиям областей."""
+    return datetime.fromtimestamp(max(float(version) for version in versions),
+                                  tz=timezone.utc)
@@ -1,58 +1,129 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, render, redirect
+from django.views.decorators.http import require_http_methods, require_POST
+
+from core.budgets import query_budget
 
+from .counters import get_stats
 from .forms import PostForm, CommentForm
-from .models import Group, Post, User, Follow
-from .utils import paginate
+from .models import ChunkedUpload, FeedEntry, Group, Post, User, Follow
+from . import thumbnails, uploads, versions
+from .decorators import conditional_page
+from .search import search as search_posts
+from .utils import LazyMap, paginate
+
+
+def index_scopes(request):
+    return [versions.global_key()]
+
+
+def group_scopes(request, slug):
+    group_id = (Group.objects
+                .filter(slug=slug)
+                .values_list('pk', flat=True)
+                .first())
+    return [versions.group_key(group_id)]
+
+
+def profile_scopes(request, username):
+    author_id = (User.objects
+                 .filter(username=username)
+                 .values_list('pk', flat=True)
+                 .first())
+    return [versions.author_key(author_id)]
+
 
+def post_scopes(request, post_id):
+    author_id = (Post.objects
+                 .filter(pk=post_id)
+                 .values_list('author_id', flat=True)
+                 .first())
+    return [versions.post_key(post_id), versions.author_key(author_id)]
 
+
+def follow_scopes(request):
+    return [versions.feed_key(request.user.pk)]
+
+
+@query_budget(5)
+@conditional_page(index_scopes)
 def index(request):
     posts = Post.objects.select_related('group', 'author').all()
 
-    page_obj = paginate(request, posts)
+    page_obj = paginate(request, posts, cursor=True)
     context = {
         'page_obj': page_obj,
+        'cache_timeout': settings.POSTS_CACHE_TIMEOUT,
+        'cache_version': versions.get_version(versions.global_key()),
     }
     return render(request, 'posts/index.html', context)
 
 
+@query_budget(7)
+@conditional_page(group_scopes)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     posts = group.posts.select_related('author').all()
 
-    page_obj = paginate(request, posts)
+    page_obj = paginate(request, posts, cursor=True)
     context = {
         'group': group,
         'page_obj': page_obj,
+        'cache_timeout': settings.POSTS_CACHE_TIMEOUT,
+        'cache_version': versions.get_version(versions.group_key(group.pk)),
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@query_budget(8)
+@conditional_page(profile_scopes)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
     posts = author.posts.select_related('group').all()
-    posts_count = posts.count()
     following = (request.user.is_authenticated
                  and request.user != author
                  and Follow.objects.filter(user=request.user, author=author)
                  .exists())
-    page_obj = paginate(request, posts)
+    page_obj = paginate(request, posts, cursor=True)
     context = {
         'author': author,
         'page_obj': page_obj,
-        'posts_count': posts_count,
+        'stats': get_stats(author),
         'following': following,
+        'cache_timeout': settings.POSTS_CACHE_TIMEOUT,
+        'cache_version': versions.get_version(versions.author_key(author.pk)),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@query_budget(6)
+def search(request):
+    query = request.GET.get('q', '')
+    page_obj = paginate(request, search_posts(query))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@query_budget(7)
+@conditional_page(post_scopes)
 def post_detail(request, post_id):
-    # был бы очень благодарен, если бы вы пояснили почему делаем именно
-    # такую выборку по автору потом по comments__author или что именно
-    # я сделал неправильно если это неверно
+    # Автор со статистикой и группа нужны в шапке поста и приходят тем
+    # же запросом через JOIN. Комментариев много, поэтому они и их
+    # авторы загружаются двумя отдельными запросами (prefetch), а не по
+    # запросу на автора каждого комментария. Повторы ловит core.nplusone.
     post = get_object_or_404(Post
                              .objects
-                             .select_related('author')
+                             .select_related('author__stats', 'group')
                              .prefetch_related('comments__author'),
                              pk=post_id)
     context = {
@@ -63,36 +134,96 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+@query_budget(9)
 @login_required
 def post_create(request):
-    form = PostForm(request.POST or None,
-                    files=request.FILES or None, )
-    if form.is_valid():
-        post = form.save(commit=False)
-        post.author = request.user
-        post.save()
-        return redirect('posts:profile', request.user)
+    with uploads.post_files(request) as files:
+        form = PostForm(request.POST or None,
+                        files=files, )
+        if form.is_valid():
+            post = form.save(commit=False)
+            post.author = request.user
+            post.save()
+            uploads.finish(files)
+            thumbnails.schedule(post)
+            return redirect('posts:profile', request.user)
     return render(request, 'posts/post_create_and_edit.html', {'form': form})
 
 
+@query_budget(8)
 @login_required
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
-    if post.author != request.user:
+    if post.author_id != request.user.pk:
         return redirect('posts:post_detail', post_id)
 
-    form = PostForm(request.POST or None,
-                    files=request.FILES or None,
-                    instance=post)
-    context = {
-        'form': form,
-    }
-    if form.is_valid():
-        form.save()
-        return redirect('posts:post_detail', post_id)
+    with uploads.post_files(request) as files:
+        form = PostForm(request.POST or None,
+                        files=files,
+                        instance=post)
+        context = {
+            'form': form,
+        }
+        if form.is_valid():
+            post = form.save()
+            uploads.finish(files)
+            if 'image' in form.changed_data:
+                thumbnails.schedule(post)
+            return redirect('posts:post_detail', post_id)
     return render(request, 'posts/post_create_and_edit.html', context)
 
 
+def upload_state(upload):
+    return {
+        'id': str(upload.pk),
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': upload.offset,
+        'complete': upload.complete,
+    }
+
+
+@query_budget(3)
+@login_required
+@require_POST
+def upload_create(request):
+    try:
+        upload = uploads.start(request.user,
+                               request.POST.get('filename'),
+                               int(request.POST.get('size', 0)))
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный размер.'}, status=400)
+    except ValidationError as error:
+        return JsonResponse({'error': error.messages[0]}, status=400)
+    return JsonResponse(upload_state(upload), status=201)
+
+
+@query_budget(4)
+@login_required
+@require_http_methods(['GET', 'HEAD', 'PATCH'])
+def upload_detail(request, upload_id):
+    upload = get_object_or_404(ChunkedUpload, pk=upload_id,
+                               user=request.user)
+    if request.method == 'PATCH':
+        try:
+            uploads.append(upload,
+                           int(request.headers['Upload-Offset']),
+                           request,
+                           int(request.META.get('CONTENT_LENGTH') or 0))
+        except uploads.OffsetMismatch as error:
+            return JsonResponse({'error': 'Неверное смещение.',
+                                 'offset': error.offset}, status=409)
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Нужен заголовок Upload-Offset.'},
+                                status=400)
+        except ValidationError as error:
+            return JsonResponse({'error': error.messages[0]}, status=400)
+    response = JsonResponse(upload_state(upload))
+    response['Upload-Offset'] = upload.offset
+    return response
+
+
+@query_budget(6)
 @login_required
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
@@ -105,19 +236,28 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@query_budget(5)
 @login_required
+@conditional_page(follow_scopes)
 def follow_index(request):
-    posts = (Post
-             .objects
-             .select_related('author', 'group')
-             .filter(author__following__user=request.user))
-    page_obj = paginate(request, posts)
+    entries = (FeedEntry
+               .objects
+               .select_related('post__author', 'post__group')
+               .filter(user=request.user))
+    page_obj = paginate(request, entries, cursor=True)
+    page_obj.object_list = LazyMap(page_obj.object_list,
+                                   lambda entry: entry.post)
     context = {
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        'cache_timeout': settings.POSTS_CACHE_TIMEOUT,
+        'cache_version': versions.get_version(
+            versions.feed_key(request.user.pk)
+        ),
     }
     return render(request, 'posts/follow.html', context)
 
 
+@query_budget(9)
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
@@ -129,6 +269,7 @@ def profile_follow(request, username):
     return redirect('posts:profile', author)
 
 
+@query_budget(7)
 @login_required
 def profile_unfollow(request, username):
     get_object_or_404(Follow,
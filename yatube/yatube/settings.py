@@ -16,8 +16,54 @@ ALLOWED_HOSTS = [
 
 POSTS_SHOW_AMOUNT = 10
 
+POSTS_CURSOR_AFTER_PAGE = 5
+
 POSTS_TEXT_LENGTH = 15
 
+FEED_BATCH_SIZE = 1000
+
+# Размеры миниатюр картинок постов: должны совпадать с тегами
+# {% thumbnail %} в шаблонах, иначе нарезка заранее не пригодится.
+POSTS_THUMBNAIL_GEOMETRIES = (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+
+POSTS_THUMBNAIL_WORKERS = 2
+
+POSTS_THUMBNAIL_QUEUE_LIMIT = 100
+
+# Адаптивные варианты картинок: ширины, форматы (AVIF — если его умеет
+# Pillow), соотношение сторон как у миниатюры 960x339.
+POSTS_IMAGE_WIDTHS = (480, 960, 1440)
+
+POSTS_IMAGE_FORMATS = ('avif', 'webp', 'jpeg')
+
+POSTS_IMAGE_RATIO = 960 / 339
+
+POSTS_IMAGE_QUALITY = 80
+
+POSTS_IMAGE_SIZES = '(min-width: 1200px) 1110px, 100vw'
+
+# Лимиты приёма картинок: больше — отказ, крупнее POSTS_IMAGE_MAX_SIZE
+# по длинной стороне — уменьшение при загрузке.
+POSTS_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+
+POSTS_IMAGE_MAX_PIXELS = 50 * 10 ** 6
+
+POSTS_IMAGE_MAX_SIZE = 2560
+
+# Загрузка по частям: куда под MEDIA_ROOT писать части и сколько байт
+# принимать одним запросом.
+POSTS_UPLOAD_DIR = 'uploads/'
+
+POSTS_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+THUMBNAIL_KVSTORE = 'core.kvstore.KVStore'
+
+THUMBNAIL_KVSTORE_LRU_SIZE = 1000
+
+THUMBNAIL_KVSTORE_LRU_TIMEOUT = 60 * 5
+
 INSTALLED_APPS = [
     'posts.apps.PostsConfig',
     'users.apps.UsersConfig',
@@ -33,6 +79,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
+    'core.middleware.NPlusOneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -42,12 +91,74 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Проверять бюджеты запросов представлений (core.budgets) на каждом
+# ответе и писать превышения в лог core.middleware. None — проверять,
+# пока включён DEBUG; он смотрится на каждом запросе, так что тестовый
+# прогон, выключающий DEBUG, проверку не включает.
+QUERY_BUDGET_CHECK = None
+
+# Искать в ответах N+1 и повторяющиеся запросы (core.nplusone) и писать
+# находки в лог core.middleware, а при NPLUSONE_RAISE бросать
+# исключение (так делают тесты tests/). None — как у QUERY_BUDGET_CHECK.
+NPLUSONE_CHECK = None
+
+NPLUSONE_RAISE = False
+
+# Со скольких выполнений одной формы запроса за ответ это N+1.
+NPLUSONE_THRESHOLD = 3
+
+# Известные и принятые формы запросов, шаблоны fnmatch по SQL без
+# параметров.
+NPLUSONE_ALLOWLIST = [
+    # Миниатюры, которых ещё нет, sorl-thumbnail создаёт при рендере по
+    # одной; готовые загружаются пачкой (posts.thumbnails.prefetch).
+    'SELECT "thumbnail_kvstore"."key", "thumbnail_kvstore"."value" '
+    'FROM "thumbnail_kvstore" WHERE "thumbnail_kvstore"."key" = %s',
+    'INSERT INTO "thumbnail_kvstore" *',
+    # posts.thumbnails.release нарочно проверяет ссылки на картинку ещё
+    # раз после фиксации транзакции.
+    'SELECT (1) AS "a" FROM "posts_post" '
+    'WHERE "posts_post"."image" = %s LIMIT 1',
+]
+
+# Какую долю запросов профилировать (core.profiling): время SQL и
+# шаблонов, попадания в кэш уходят в заголовок Server-Timing и в лог
+# core.profiling. При DEBUG профилируется каждый запрос, 0 отключает
+# профилирование совсем. Тесты (core.runner) идут с 0.
+PROFILING_SAMPLE_RATE = 0.01
+
+# Представления каких пространств имён URL профилировать.
+PROFILING_NAMESPACES = ('posts', 'users')
+
+# Профили запросов пишутся в лог core.profiling на уровне INFO, который
+# без настройки отбрасывается: выводим их в stdout, откуда их заберёт
+# сборщик логов.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'profiling': {
+            'class': 'logging.StreamHandler',
+            'stream': 'ext://sys.stdout',
+        },
+    },
+    'loggers': {
+        'core.profiling': {
+            'handlers': ['profiling'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+# Бэкенд шаблонов и кэша из core.profiling — штатные, но замеряют время
+# рендера и попадания в кэш для профилирования запросов.
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.profiling.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -62,14 +173,31 @@ TEMPLATES = [
     },
 ]
 
+CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+# Попадания и промахи кэша считает обёртка core.profiling, настоящий
+# бэкенд указывается в PROFILED_BACKEND.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.profiling.profiled_cache',
+        'PROFILED_BACKEND': CACHE_BACKEND,
     }
 }
 
+# Версии лент (posts.versions) лежат в кэше default. Кэш в памяти у
+# каждого процесса свой, и сдвиг версии в одном процессе не виден
+# другим, поэтому с ним фрагменты лент и сами версии живут секунды.
+# Часами их можно хранить только в общем кэше (memcached, redis).
+SHARED_CACHE = not CACHE_BACKEND.endswith('LocMemCache')
+
+POSTS_CACHE_TIMEOUT = 60 * 60 * 4 if SHARED_CACHE else 20
+
+POSTS_VERSION_TIMEOUT = None if SHARED_CACHE else 20
+
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+TEST_RUNNER = 'core.runner.DiscoverRunner'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -106,6 +234,21 @@ STATIC_URL = '/static/'
 
 STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
 
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# Имена с хэшем содержимого и сжатые копии .gz (и .br, если установлен
+# пакет brotli), которые готовит collectstatic.
+STATICFILES_STORAGE = 'core.staticfiles.CompressedManifestStaticFilesStorage'
+
+# Сколько потоков сжимают статику и файлы меньше какого размера в байтах
+# не сжимаются.
+STATIC_COMPRESS_WORKERS = 4
+
+STATIC_COMPRESS_MIN_SIZE = 256
+
+# Срок кэширования статики без хэша в имени.
+STATIC_CACHE_MAX_AGE = 60 * 60
+
 LOGIN_URL = 'users:login'
 
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -119,6 +262,15 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Отдача медиа: префикс internal-location nginx для X-Accel-Redirect или
+# X-Sendfile для Apache/lighttpd. Без них файлы отдаёт сам Django.
+MEDIA_X_ACCEL_PREFIX = None
+
+MEDIA_X_SENDFILE = False
+
+# Срок кэширования медиа с именами не из хэша содержимого.
+MEDIA_CACHE_MAX_AGE = 60 * 60
+
 # ADMINS = Список администраторов для email
 
 # MANAGERS = Список менеджеров для email
@@ -1,7 +1,8 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from core.views import serve_media, serve_static
 
 handler404 = 'core.views.page_not_found'
 # В теории об этом не говорилось, но добавил из-за pytest
@@ -13,9 +14,11 @@ urlpatterns = [
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls')),
     path('', include('posts.urls', namespace='posts')),
+    re_path(rf'^{settings.MEDIA_URL.lstrip("/")}(?P<path>.*)$',
+            serve_media,
+            name='media'),
+    # При DEBUG статику из STATICFILES_DIRS раньше перехватывает runserver.
+    re_path(rf'^{settings.STATIC_URL.lstrip("/")}(?P<path>.*)$',
+            serve_static,
+            name='static'),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
-    )